@@ -1,13 +1,76 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from fastapi import Request, Response
-from app.routes import leave, auth
+from pymongo.errors import ConnectionFailure, ExecutionTimeout, ServerSelectionTimeoutError
+from app.routes import leave, auth, events
+from app.models.db import ensure_indexes, assign_default_org
+from app.utils.scheduler import register_job, start_scheduler, stop_scheduler
+from app.utils.reminders import run_reminder_cycle, REMINDER_SCAN_INTERVAL_SECONDS
+from app.utils.notifications import dispatch_notifications, NOTIFICATION_DISPATCH_INTERVAL_SECONDS
+from app.utils.events import deliver_webhooks, WEBHOOK_DISPATCH_INTERVAL_SECONDS
+from app.utils.live import start_change_listener, stop_change_listener
+from app.utils.archive import archive_decided_leaves, ARCHIVE_INTERVAL_SECONDS
+from app.utils.resilience import breakers, mongo_breaker
+from contextlib import asynccontextmanager
+import asyncio
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
-app = FastAPI(title="Leave Approval System API", version="1.0.0")
+# Background jobs run in every worker; exclusive jobs coordinate through a lease
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() == "true"
+
+register_job("leave-reminders", REMINDER_SCAN_INTERVAL_SECONDS, run_reminder_cycle)
+# Notifications are claimed one by one, so every worker can help delivering them
+register_job("employee-notifications", NOTIFICATION_DISPATCH_INTERVAL_SECONDS, dispatch_notifications, exclusive=False)
+# Webhook cursors are per subscriber, so a single worker delivers them in order
+register_job("event-webhooks", WEBHOOK_DISPATCH_INTERVAL_SECONDS, deliver_webhooks)
+register_job("leave-archival", ARCHIVE_INTERVAL_SECONDS, archive_decided_leaves)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        assign_default_org()
+        ensure_indexes()
+    except Exception as e:
+        # Don't block startup - the API still works without the indexes, only slower
+        print(f"Database setup failed: {str(e)}")
+    
+    # One change stream per worker feeds every manager dashboard stream
+    start_change_listener(asyncio.get_running_loop())
+    if SCHEDULER_ENABLED:
+        start_scheduler()
+    yield
+    stop_change_listener()
+    if SCHEDULER_ENABLED:
+        await stop_scheduler()
+
+app = FastAPI(title="Leave Approval System API", version="1.0.0", lifespan=lifespan)
+
+@app.exception_handler(ConnectionFailure)
+@app.exception_handler(ExecutionTimeout)
+async def mongo_unavailable_handler(request: Request, exc: Exception):
+    # Failed commands are already counted by the command listener in app.models.db;
+    # server selection fails before any command is sent, so count it here
+    if isinstance(exc, ServerSelectionTimeoutError):
+        mongo_breaker.record_failure(exc)
+    print(f"MongoDB unavailable: {str(exc)}")
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Database temporarily unavailable. Please try again shortly."},
+        headers={"Retry-After": str(mongo_breaker.reset_timeout)}
+    )
+
+def require_mongo():
+    # Fail fast while the database breaker is open instead of waiting for timeouts
+    if not mongo_breaker.allow():
+        raise HTTPException(
+            status_code=503,
+            detail="Database temporarily unavailable. Please try again shortly.",
+            headers={"Retry-After": str(mongo_breaker.reset_timeout)}
+        )
 
 # AMP Email CORS Middleware
 @app.middleware("http")
@@ -84,9 +147,15 @@ app.add_middleware(
     ],
 )
 
-app.include_router(auth.router, prefix="/auth", tags=["auth"])
-app.include_router(leave.router, prefix="/leave", tags=["leave"])
+app.include_router(auth.router, prefix="/auth", tags=["auth"], dependencies=[Depends(require_mongo)])
+app.include_router(leave.router, prefix="/leave", tags=["leave"], dependencies=[Depends(require_mongo)])
+app.include_router(events.router, prefix="/events", tags=["events"], dependencies=[Depends(require_mongo)])
 
 @app.get("/")
 def root():
     return {"message": "Leave Application System API", "version": "1.0.0"}
+
+@app.get("/health/breakers")
+def get_breakers():
+    """State of the circuit breakers around SMTP, token storage and MongoDB"""
+    return {"breakers": [breaker.snapshot() for breaker in breakers.values()]}
@@ -1,15 +1,221 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, ASCENDING, ReadPreference, WriteConcern
 from pymongo.collection import Collection
+from pymongo.read_preferences import SecondaryPreferred
+from pymongo import monitoring
+from pymongo import errors
+from pymongo.errors import DuplicateKeyError
 from bson import ObjectId
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
 import os
 from dotenv import load_dotenv
+from app.utils.resilience import mongo_breaker
 
 load_dotenv()
 
+# Explicit deadlines so an unreachable cluster fails requests quickly instead of hanging workers
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", 5000))
+MONGODB_CONNECT_TIMEOUT_MS = int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", 5000))
+MONGODB_SOCKET_TIMEOUT_MS = int(os.getenv("MONGODB_SOCKET_TIMEOUT_MS", 15000))
+
+# Dashboard and analytics reads may be served by secondaries lagging at most this much (MongoDB minimum is 90)
+MONGODB_SECONDARY_READS = os.getenv("MONGODB_SECONDARY_READS", "true").lower() == "true"
+MONGODB_MAX_STALENESS_SECONDS = max(90, int(os.getenv("MONGODB_MAX_STALENESS_SECONDS", 90)))
+
+# Used and revoked approval tokens are kept this long for auditing, then purged
+SPENT_TOKEN_RETENTION_HOURS = int(os.getenv("SPENT_TOKEN_RETENTION_HOURS", 24))
+
+# Organization of users and data created before multi-tenancy (and of JWTs without an org claim)
+DEFAULT_ORG_ID = os.getenv("DEFAULT_ORG_ID", "default")
+
 MONGODB_URI = os.getenv("MONGODB_URI")
-client = MongoClient(MONGODB_URI)
+
+# Server error codes meaning the deployment (not the command) is in trouble:
+# MaxTimeMSExpired, host unreachable/not found, network timeout, socket errors, shutdowns and primary step-downs
+UNAVAILABLE_ERROR_CODES = {50, 6, 7, 89, 9001, 91, 11600, 11602, 189, 10107, 13435, 13436}
+
+def _is_unavailable(failure: dict) -> bool:
+    # Network errors carry the exception class name, server errors their reply document
+    error_type = getattr(errors, str(failure.get("errtype")), None)
+    if isinstance(error_type, type) and issubclass(error_type, errors.ConnectionFailure):
+        return True
+    return failure.get("code") in UNAVAILABLE_ERROR_CODES
+
+class BreakerCommandListener(monitoring.CommandListener):
+    """
+    Feeds the MongoDB breaker from every command, including the ones whose errors are caught by callers
+    Successes close it (e.g. after a half-open probe); network errors and timeouts count as failures,
+    while ordinary command errors (duplicate keys, validation...) don't count either way
+    Server selection timeouts never reach a command, so app.main records those
+    """
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        mongo_breaker.record_success()
+
+    def failed(self, event):
+        if _is_unavailable(event.failure or {}):
+            mongo_breaker.record_failure(Exception(event.failure.get("errmsg", event.command_name)))
+
+client = MongoClient(
+    MONGODB_URI,
+    serverSelectionTimeoutMS=MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+    connectTimeoutMS=MONGODB_CONNECT_TIMEOUT_MS,
+    socketTimeoutMS=MONGODB_SOCKET_TIMEOUT_MS,
+    event_listeners=[BreakerCommandListener()]
+)
 db = client.get_default_database()
 
+# State transitions and approval tokens are acknowledged by a majority, so a failover can't roll them back
+majority = WriteConcern("majority")
+
 users_collection: Collection = db["users"]
-leaves_collection: Collection = db["leave_requests"]
-tokens_collection: Collection = db["approval_tokens"]
+leaves_collection: Collection = db.get_collection("leave_requests", write_concern=majority)
+tokens_collection: Collection = db.get_collection("approval_tokens", write_concern=majority)
+leaves_archive_collection: Collection = db["leave_requests_archive"]
+
+# Read-only views for list/dashboard queries; state checks keep using the primary collections above
+read_preference = SecondaryPreferred(max_staleness=MONGODB_MAX_STALENESS_SECONDS) if MONGODB_SECONDARY_READS else ReadPreference.PRIMARY
+read_db = client.get_default_database(read_preference=read_preference)
+
+users_read_collection: Collection = read_db["users"]
+leaves_read_collection: Collection = read_db["leave_requests"]
+leaves_archive_read_collection: Collection = read_db["leave_requests_archive"]
+idempotency_collection: Collection = db["idempotency_keys"]
+rate_limits_collection: Collection = db["rate_limits"]
+scheduler_locks_collection: Collection = db["scheduler_locks"]
+notifications_collection: Collection = db["notification_outbox"]
+events_collection: Collection = db["leave_events"]
+counters_collection: Collection = db["counters"]
+webhook_state_collection: Collection = db["webhook_subscriptions"]
+webhook_dead_letters_collection: Collection = db["webhook_dead_letters"]
+invites_collection: Collection = db["org_invites"]
+causal_tokens_collection: Collection = db["causal_tokens"]
+
+@contextmanager
+def write_session(*user_ids):
+    """
+    Causally consistent session for a state change
+    Afterwards the given users' next reads wait for this write, even on a secondary
+    
+    Args:
+        user_ids: Users whose dashboards must reflect the write (e.g. employee and manager)
+    """
+    with client.start_session(causal_consistency=True) as session:
+        yield session
+        if session.operation_time is None:
+            # Standalone server: no secondaries, so nothing to wait for
+            return
+        # Stored on the primary rather than in this worker, so the users' next reads wait
+        # for the write whichever worker serves them
+        recorded_at = datetime.now(timezone.utc)
+        for user_id in user_ids:
+            try:
+                causal_tokens_collection.update_one(
+                    {"_id": str(user_id), "operation_time": {"$lt": session.operation_time}},
+                    {"$set": {
+                        "operation_time": session.operation_time,
+                        "cluster_time": session.cluster_time,
+                        "recorded_at": recorded_at
+                    }},
+                    upsert=True
+                )
+            except DuplicateKeyError:
+                # A newer write of this user is already recorded
+                pass
+            except Exception as e:
+                # The write itself succeeded; at worst the next read may be briefly stale
+                print(f"Failed to record causal token for {user_id}: {str(e)}")
+
+@contextmanager
+def read_session(user_id):
+    """
+    Session for a user's dashboard reads, guaranteeing they see the user's own recent writes
+    Secondaries lag at most MONGODB_MAX_STALENESS_SECONDS, so older writes need no waiting
+    """
+    with client.start_session(causal_consistency=True) as session:
+        if MONGODB_SECONDARY_READS:
+            recent = datetime.now(timezone.utc) - timedelta(seconds=MONGODB_MAX_STALENESS_SECONDS)
+            last_write = causal_tokens_collection.find_one({"_id": str(user_id), "recorded_at": {"$gt": recent}})
+            if last_write:
+                session.advance_cluster_time(last_write["cluster_time"])
+                session.advance_operation_time(last_write["operation_time"])
+        yield session
+
+def ensure_indexes():
+    """
+    Create the indexes the application relies on
+    Safe to call on every startup - existing indexes are left untouched
+    """
+    # Idempotency records expire on their own once the replay window is over
+    idempotency_collection.create_index([("expires_at", ASCENDING)], expireAfterSeconds=0)
+    
+    # Rate limit buckets and lockouts are dropped once they have been idle long enough
+    rate_limits_collection.create_index([("expires_at", ASCENDING)], expireAfterSeconds=0)
+    
+    # Causal tokens only matter until secondaries are guaranteed to have caught up
+    causal_tokens_collection.create_index([("recorded_at", ASCENDING)], expireAfterSeconds=MONGODB_MAX_STALENESS_SECONDS)
+    
+    # Unused invites disappear once they expire
+    invites_collection.create_index([("expires_at", ASCENDING)], expireAfterSeconds=0)
+    
+    # Tenant-scoped queries lead with org_id, so each organization reads its own index range
+    # (and, once sharded on org_id, its own shards)
+    users_collection.create_index([("org_id", ASCENDING), ("email", ASCENDING)])
+    leaves_collection.create_index([("org_id", ASCENDING), ("_id", ASCENDING)])
+    leaves_archive_collection.create_index([("org_id", ASCENDING), ("_id", ASCENDING)])
+    
+    # Manager pending queues
+    leaves_collection.create_index([("org_id", ASCENDING), ("manager_id", ASCENDING), ("status", ASCENDING), ("is_action_taken", ASCENDING)])
+    
+    # Stale pending leaves are found with a range query on created_at (background job, across organizations)
+    leaves_collection.create_index([("status", ASCENDING), ("is_action_taken", ASCENDING), ("created_at", ASCENDING)])
+    
+    # Due notifications are claimed by state and retry time; delivered ones are kept for a week
+    notifications_collection.create_index([("state", ASCENDING), ("next_attempt_at", ASCENDING)])
+    notifications_collection.create_index([("sent_at", ASCENDING)], expireAfterSeconds=7 * 24 * 3600)
+    
+    # The event feed is read by sequence number; old events are dropped after the retention period
+    events_collection.create_index([("seq", ASCENDING)], unique=True)
+    events_collection.create_index([("org_id", ASCENDING), ("seq", ASCENDING)])
+    events_collection.create_index([("created_at", ASCENDING)], expireAfterSeconds=int(os.getenv("EVENT_RETENTION_DAYS", 30)) * 24 * 3600)
+    
+    # Team calendar feeds read approved leaves per department, newest decision first
+    leaves_collection.create_index([("org_id", ASCENDING), ("employee_department", ASCENDING), ("status", ASCENDING), ("action_timestamp", ASCENDING)])
+    
+    # Employee history is read from the hot and the archive tier the same way
+    leaves_collection.create_index([("org_id", ASCENDING), ("employee_id", ASCENDING), ("created_at", ASCENDING)])
+    leaves_archive_collection.create_index([("org_id", ASCENDING), ("employee_id", ASCENDING), ("created_at", ASCENDING)])
+    
+    # Decided leaves are moved to the archive by decision date (background job, across organizations)
+    leaves_collection.create_index([("is_action_taken", ASCENDING), ("action_timestamp", ASCENDING)])
+    
+    # Token lookups, and continuous purging of expired, used and revoked tokens
+    tokens_collection.create_index([("token", ASCENDING)])
+    tokens_collection.create_index([("leave_id", ASCENDING), ("is_used", ASCENDING)])
+    tokens_collection.create_index([("expires_at", ASCENDING)], expireAfterSeconds=0)
+    tokens_collection.create_index([("used_at", ASCENDING)], expireAfterSeconds=SPENT_TOKEN_RETENTION_HOURS * 3600)
+    tokens_collection.create_index([("revoked_at", ASCENDING)], expireAfterSeconds=SPENT_TOKEN_RETENTION_HOURS * 3600)
+
+def assign_default_org():
+    """
+    Put documents created before multi-tenancy into DEFAULT_ORG_ID
+    Only touches documents without an org_id, so it is cheap to run on every startup
+    """
+    for collection in (users_collection, leaves_collection, leaves_archive_collection, tokens_collection):
+        result = collection.update_many({"org_id": {"$exists": False}}, {"$set": {"org_id": DEFAULT_ORG_ID}})
+        if result.modified_count:
+            print(f"Assigned {result.modified_count} {collection.name} document(s) to organization '{DEFAULT_ORG_ID}'")
+
+def shard_collections():
+    """
+    Shard the leave collections on (org_id, _id) so organizations spread across shards
+    Only for sharded clusters - run once by hand: python -c "from app.models.db import shard_collections; shard_collections()"
+    Upserts and targeted writes on these collections must filter on org_id as well as _id
+    """
+    client.admin.command("enableSharding", db.name)
+    for collection in (leaves_collection, leaves_archive_collection):
+        collection.create_index([("org_id", ASCENDING), ("_id", ASCENDING)])
+        client.admin.command("shardCollection", f"{db.name}.{collection.name}", key={"org_id": 1, "_id": 1})
+        print(f"Sharded {collection.name} on (org_id, _id)")
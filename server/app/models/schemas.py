@@ -30,6 +30,7 @@ class User(BaseModel):
     full_name: str
     is_manager: bool = False
     is_hr: bool = False
+    org_id: str = "default"
 
 class LeaveRequestCreate(BaseModel):
     start_date: str
@@ -45,6 +46,7 @@ class LeaveRequest(BaseModel):
     )
     
     id: Optional[PyObjectId] = Field(default=None, alias="_id")
+    org_id: str = "default"
     employee_id: Optional[PyObjectId] = None
     manager_id: Optional[PyObjectId] = None
     start_date: str
@@ -72,9 +74,15 @@ class UserCreate(BaseModel):
     full_name: str
     role: str = "employee"
     department: str
+    invite_code: Optional[str] = None  # Joins the invite's organization with its role; DEFAULT_ORG_ID without one
+
+class InviteCreate(BaseModel):
+    role: str = "employee"
+    email: Optional[EmailStr] = None
 
 class ApprovalToken(BaseModel):
     token: str
+    org_id: str = "default"
     leave_id: str
     manager_id: str
     action: str  # "approve" or "reject"
@@ -1,8 +1,10 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request
 from fastapi.security import OAuth2PasswordRequestForm
-from app.models.db import users_collection
-from app.models.schemas import Token, UserCreate
-from app.utils.auth import verify_password, get_password_hash, create_access_token, verify_token
+from app.models.db import users_collection, users_read_collection
+from app.models.schemas import Token, UserCreate, InviteCreate
+from app.utils.auth import verify_password, get_password_hash, create_access_token, verify_token, verify_org, DEFAULT_ORG_ID
+from app.utils.invites import create_invite, redeem_invite, release_invite, ROLES
+from app.utils.rate_limit import client_ip, check_rate_limit, check_lockout, record_failure, record_success
 from bson import ObjectId
 from datetime import timedelta
 import os
@@ -18,23 +20,54 @@ def register_user(user_data: UserCreate):
     if users_collection.find_one({"username": user_data.username}):
         raise HTTPException(status_code=400, detail="Username already taken")
     
+    # The organization (and role) of an invited user come from the invite, never from the request
+    org_id, role = DEFAULT_ORG_ID, user_data.role
+    if user_data.invite_code:
+        invite = redeem_invite(user_data.invite_code, user_data.email)
+        org_id, role = invite["org_id"], invite["role"]
+    
     # Create user document
     user_dict = {
         "username": user_data.username,
         "email": user_data.email,
         "hashed_password": get_password_hash(user_data.password),
         "full_name": user_data.full_name,
-        "role": user_data.role,
+        "role": role,
         "department": user_data.department,
-        "is_manager": user_data.role == "manager",
-        "is_hr": user_data.role == "hr"
+        "is_manager": role == "manager",
+        "is_hr": role == "hr",
+        "org_id": org_id
     }
     
-    result = users_collection.insert_one(user_dict)
+    try:
+        result = users_collection.insert_one(user_dict)
+    except Exception:
+        if user_data.invite_code:
+            release_invite(user_data.invite_code)
+        raise
     return {"user_id": str(result.inserted_id), "message": "User registered successfully"}
 
+@router.post("/invites")
+def invite_user(invite_data: InviteCreate, user_id: str = Depends(verify_token), org_id: str = Depends(verify_org)):
+    # HR invites people into their own organization only
+    user = users_collection.find_one({"_id": ObjectId(user_id), "org_id": org_id})
+    if not user or not user.get("is_hr"):
+        raise HTTPException(status_code=403, detail="Access denied. HR role required.")
+    
+    if invite_data.role not in ROLES:
+        raise HTTPException(status_code=400, detail=f"Role must be one of: {', '.join(ROLES)}")
+    
+    code = create_invite(org_id, invite_data.role, invite_data.email, user_id)
+    return {"invite_code": code, "org_id": org_id, "role": invite_data.role}
+
 @router.post("/login", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends()):
+def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends()):
+    # Throttle before touching the database or bcrypt; the account is only charged for failures
+    ip_key = f"ip:{client_ip(request)}"
+    user_key = f"user:{form_data.username.lower()}"
+    check_rate_limit(ip_key)
+    check_lockout(user_key)
+    
     # Try to find user by username or email
     user = users_collection.find_one({
         "$or": [
@@ -44,17 +77,20 @@ def login(form_data: OAuth2PasswordRequestForm = Depends()):
     })
     
     if not user or not verify_password(form_data.password, user["hashed_password"]):
+        record_failure(user_key)
         raise HTTPException(status_code=401, detail="Incorrect username/email or password")
     
+    record_success(user_key)
+    
     access_token = create_access_token(
-        data={"sub": str(user["_id"]), "email": user["email"]},
+        data={"sub": str(user["_id"]), "email": user["email"], "org": user.get("org_id", DEFAULT_ORG_ID)},
         expires_delta=timedelta(minutes=60*24)
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.get("/me")
 def get_current_user(user_id: str = Depends(verify_token)):
-    user = users_collection.find_one({"_id": ObjectId(user_id)})
+    user = users_read_collection.find_one({"_id": ObjectId(user_id)})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -67,7 +103,8 @@ def get_current_user(user_id: str = Depends(verify_token)):
         "role": user["role"],
         "department": user["department"],
         "is_manager": user.get("is_manager", False),
-        "is_hr": user.get("is_hr", False)
+        "is_hr": user.get("is_hr", False),
+        "org_id": user.get("org_id", DEFAULT_ORG_ID)
     }
     
     return user_data
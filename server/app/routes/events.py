@@ -0,0 +1,42 @@
+import asyncio
+
+from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.concurrency import run_in_threadpool
+from app.models.db import users_collection
+from app.utils.auth import verify_token, verify_org
+from app.utils.events import list_events
+from bson import ObjectId
+
+router = APIRouter()
+
+# How often a waiting long-poll checks for new events
+POLL_INTERVAL_SECONDS = 1
+
+@router.get("")
+async def get_events(
+    after: int = Query(0, ge=0, description="Cursor (id of the last event received)"),
+    limit: int = Query(100, ge=1, le=1000),
+    wait: int = Query(25, ge=0, le=60, description="Seconds to wait for new events before returning an empty list"),
+    user_id: str = Depends(verify_token),
+    org_id: str = Depends(verify_org)
+):
+    """
+    Resumable feed of leave lifecycle events for downstream systems (payroll, attendance, calendars)
+    Only events of the caller's organization are returned
+    Returns as soon as events are available, or after `wait` seconds with an empty list
+    """
+    user = await run_in_threadpool(users_collection.find_one, {"_id": ObjectId(user_id)})
+    if not user or not user.get("is_hr"):
+        raise HTTPException(status_code=403, detail="Access denied. HR role required.")
+    
+    deadline = asyncio.get_running_loop().time() + wait
+    while True:
+        events = await run_in_threadpool(list_events, after, limit, org_id)
+        if events or asyncio.get_running_loop().time() >= deadline:
+            break
+        await asyncio.sleep(POLL_INTERVAL_SECONDS)
+    
+    return {
+        "events": events,
+        "next_cursor": events[-1]["id"] if events else str(after)
+    }
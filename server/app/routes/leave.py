@@ -1,30 +1,69 @@
-from fastapi import APIRouter, HTTPException, Depends, Request, status, Form
-from app.models.db import leaves_collection, users_collection, tokens_collection
+from fastapi import APIRouter, HTTPException, Depends, Request, status, Form, Header
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, Response
+from app.models.db import (
+    leaves_collection, users_collection, tokens_collection,
+    leaves_read_collection, users_read_collection, write_session, read_session
+)
 from app.models.schemas import LeaveRequestCreate, LeaveRequest, LeaveActionRequest
-from app.utils.auth import verify_token, verify_password
+from app.utils.auth import verify_token, verify_password, verify_stream_token, verify_org, verify_stream_org, DEFAULT_ORG_ID
 from app.utils.email import send_leave_action_email, notify_employee
 from app.utils.tokens import verify_token as verify_approval_token, use_token, revoke_tokens_for_leave
+from app.utils.idempotency import derive_key, run_idempotent
+from app.utils.rate_limit import client_ip, check_rate_limit, check_lockout, record_failure, record_success
+from app.utils.events import emit_event
+from app.utils.live import hub
+from app.utils.serializers import serialize_leave
+from app.utils.archive import find_leaves
+from app.utils.calendar import calendar_feed_key, get_calendar_etag, get_calendar_body, invalidate_calendar
 from bson import ObjectId
 from datetime import datetime, timezone
 from typing import Optional, List
+from urllib.parse import quote
+import asyncio
+import hmac
+import json
+import os
 
 router = APIRouter()
 
+SSE_HEARTBEAT_SECONDS = 20
+
+BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
+
 @router.post("/submit")
-def submit_leave(leave: LeaveRequestCreate, user_id: str = Depends(verify_token)):
+def submit_leave(
+    leave: LeaveRequestCreate,
+    user_id: str = Depends(verify_token),
+    org_id: str = Depends(verify_org),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    # Retried submissions with the same client key replay the first response instead of creating a duplicate leave.
+    # Without a key every submission is new - an identical body may legitimately be resubmitted (e.g. after a rejection).
+    if not idempotency_key:
+        return create_leave_request(leave, user_id, org_id)
+    
+    key = derive_key("submit", user_id, idempotency_key)
+    return run_idempotent(key, lambda: create_leave_request(leave, user_id, org_id))
+
+def create_leave_request(leave: LeaveRequestCreate, user_id: str, org_id: str = DEFAULT_ORG_ID):
+    # Per-tenant submission quota, so one organization's bulk import can't crowd out the others
+    check_rate_limit(f"org-submit:{org_id}")
+    
     # Get user details
-    user = users_collection.find_one({"_id": ObjectId(user_id)})
+    user = users_collection.find_one({"_id": ObjectId(user_id), "org_id": org_id})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    # Find manager by email
-    manager = users_collection.find_one({"email": leave.manager_email})
+    # Find manager by email, within the employee's organization only
+    manager = users_collection.find_one({"org_id": org_id, "email": leave.manager_email})
     if not manager:
         raise HTTPException(status_code=404, detail="Manager not found")
     
     # Create leave request
     leave_dict = leave.model_dump()
     leave_dict.update({
+        "org_id": org_id,
         "employee_id": ObjectId(user_id),
         "manager_id": ObjectId(manager["_id"]),
         "status": "pending",
@@ -35,7 +74,10 @@ def submit_leave(leave: LeaveRequestCreate, user_id: str = Depends(verify_token)
         "employee_department": user.get("department", "Unknown Department")
     })
     
-    result = leaves_collection.insert_one(leave_dict)
+    # Both dashboards affected by the new leave must see it on their next read
+    with write_session(user_id, manager["_id"]) as session:
+        result = leaves_collection.insert_one(leave_dict, session=session)
+    emit_event("leave.submitted", leave_dict)
     
     # Try to send email to manager (optional)
     try:
@@ -48,48 +90,122 @@ def submit_leave(leave: LeaveRequestCreate, user_id: str = Depends(verify_token)
     return {"leave_request_id": str(result.inserted_id), "status": "pending"}
 
 @router.get("/my-requests", response_model=List[dict])
-def get_my_requests(user_id: str = Depends(verify_token)):
-    leaves = list(leaves_collection.find({"employee_id": ObjectId(user_id)}))
-    for leave in leaves:
-        leave["_id"] = str(leave["_id"])
-        leave["employee_id"] = str(leave["employee_id"])
-        leave["manager_id"] = str(leave["manager_id"])
-        if leave.get("approver_id"):
-            leave["approver_id"] = str(leave["approver_id"])
-    return leaves
+def get_my_requests(include_archived: bool = False, user_id: str = Depends(verify_token), org_id: str = Depends(verify_org)):
+    # Leaves decided long ago live in the archive and are only read when asked for
+    with read_session(user_id) as session:
+        leaves = find_leaves({"org_id": org_id, "employee_id": ObjectId(user_id)}, include_archived, session)
+    return [serialize_leave(leave) for leave in leaves]
 
-@router.get("/pending-approvals", response_model=List[dict])
-def get_pending_approvals(user_id: str = Depends(verify_token)):
+def require_manager(user_id: str):
     # Check if user is a manager
-    user = users_collection.find_one({"_id": ObjectId(user_id)})
+    user = users_read_collection.find_one({"_id": ObjectId(user_id)})
     if not user or not user.get("is_manager"):
         raise HTTPException(status_code=403, detail="Access denied. Manager role required.")
+
+def find_pending_approvals(manager_id: str, org_id: str):
+    with read_session(manager_id) as session:
+        leaves = list(leaves_read_collection.find({
+            "org_id": org_id,
+            "manager_id": ObjectId(manager_id), 
+            "status": "pending",
+            "is_action_taken": False
+        }, session=session))
+    return [serialize_leave(leave) for leave in leaves]
+
+@router.get("/pending-approvals", response_model=List[dict])
+def get_pending_approvals(user_id: str = Depends(verify_token), org_id: str = Depends(verify_org)):
+    require_manager(user_id)
+    return find_pending_approvals(user_id, org_id)
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.get("/pending-approvals/stream")
+async def stream_pending_approvals(
+    request: Request,
+    user_id: str = Depends(verify_stream_token),
+    org_id: str = Depends(verify_stream_org)
+):
+    """
+    Server-sent events for the manager dashboard
+    Starts with a `snapshot` of the pending queue, then sends `add` / `remove` events
+    as leaves enter or leave it. A `resync` event means the client should reload the list.
+    """
+    await run_in_threadpool(require_manager, user_id)
     
-    leaves = list(leaves_collection.find({
-        "manager_id": ObjectId(user_id), 
-        "status": "pending",
-        "is_action_taken": False
-    }))
-    
-    for leave in leaves:
-        leave["_id"] = str(leave["_id"])
-        leave["employee_id"] = str(leave["employee_id"])
-        leave["manager_id"] = str(leave["manager_id"])
-        if leave.get("approver_id"):
-            leave["approver_id"] = str(leave["approver_id"])
-    return leaves
+    async def event_stream():
+        # Subscribe before taking the snapshot so no change falls in between
+        queue = hub.subscribe(user_id)
+        try:
+            snapshot = await run_in_threadpool(find_pending_approvals, user_id, org_id)
+            yield _sse("snapshot", snapshot)
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=SSE_HEARTBEAT_SECONDS)
+                    yield _sse(event["type"], event["data"])
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    # Comment line keeps proxies (e.g. Heroku's 55s idle timeout) from closing the stream
+                    yield ": keep-alive\n\n"
+        finally:
+            hub.unsubscribe(user_id, queue)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/calendar-url")
+def get_calendar_url(user_id: str = Depends(verify_token), org_id: str = Depends(verify_org)):
+    """
+    Subscription URL of the approved-leave calendar of the user's department
+    """
+    user = users_collection.find_one({"_id": ObjectId(user_id)})
+    if not user or not user.get("department"):
+        raise HTTPException(status_code=404, detail="User department not found")
+    
+    department = user["department"]
+    key = calendar_feed_key(org_id, department)
+    return {
+        "department": department,
+        "url": f"{BACKEND_URL}/leave/calendar/{quote(department)}.ics?org={quote(org_id)}&key={key}"
+    }
+
+@router.get("/calendar/{department}.ics")
+def get_team_calendar(department: str, key: str, request: Request, org: str = DEFAULT_ORG_ID):
+    """
+    iCalendar feed of approved leaves for a department
+    Supports conditional GET, so polling calendar clients mostly get an empty 304
+    """
+    if not hmac.compare_digest(key, calendar_feed_key(org, department)):
+        raise HTTPException(status_code=403, detail="Invalid calendar key")
+    
+    etag = get_calendar_etag(org, department)
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=300"}
+    
+    if_none_match = request.headers.get("If-None-Match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    
+    return Response(
+        content=get_calendar_body(org, department, etag),
+        media_type="text/calendar; charset=utf-8",
+        headers=headers
+    )
 
 @router.post("/{leave_id}/approve")
-def approve_leave(leave_id: str, action_data: LeaveActionRequest, user_id: str = Depends(verify_token)):
-    return process_leave_action(leave_id, "approved", user_id, action_data.comments)
+def approve_leave(leave_id: str, action_data: LeaveActionRequest, user_id: str = Depends(verify_token), org_id: str = Depends(verify_org)):
+    return process_leave_action(leave_id, "approved", user_id, action_data.comments, org_id)
 
 @router.post("/{leave_id}/reject") 
-def reject_leave(leave_id: str, action_data: LeaveActionRequest, user_id: str = Depends(verify_token)):
-    return process_leave_action(leave_id, "rejected", user_id, action_data.comments)
+def reject_leave(leave_id: str, action_data: LeaveActionRequest, user_id: str = Depends(verify_token), org_id: str = Depends(verify_org)):
+    return process_leave_action(leave_id, "rejected", user_id, action_data.comments, org_id)
 
-def process_leave_action(leave_id: str, action: str, user_id: str, comments: Optional[str] = None):
+def process_leave_action(leave_id: str, action: str, user_id: str, comments: Optional[str] = None, org_id: str = DEFAULT_ORG_ID):
     # Find leave request
-    leave = leaves_collection.find_one({"_id": ObjectId(leave_id)})
+    leave = leaves_collection.find_one({"_id": ObjectId(leave_id), "org_id": org_id})
     if not leave:
         raise HTTPException(status_code=404, detail="Leave request not found")
     
@@ -112,13 +228,18 @@ def process_leave_action(leave_id: str, action: str, user_id: str, comments: Opt
     if comments:
         update_data["comments"] = comments
     
-    leaves_collection.update_one({"_id": ObjectId(leave_id)}, {"$set": update_data})
+    with write_session(user_id, leave["employee_id"]) as session:
+        leaves_collection.update_one({"org_id": org_id, "_id": ObjectId(leave_id)}, {"$set": update_data}, session=session)
     
     # Revoke any pending email tokens for this leave
     revoke_tokens_for_leave(leave_id)
     
+    emit_event(f"leave.{action}", {**leave, **update_data})
+    if action == "approved":
+        invalidate_calendar(org_id, leave.get("employee_department"))
+    
     # Notify employee
-    notify_employee(leave, action)
+    notify_employee(leave, action, comments)
     
     return {
         "status": action,
@@ -135,8 +256,8 @@ def process_leave_action_with_password(leave_id: str, action: str, manager_id: s
     if leave.get("is_action_taken"):
         raise HTTPException(status_code=400, detail=f"This leave request has already been {leave.get('status', 'processed')}. No further action is required.")
     
-    # Verify manager password
-    manager = users_collection.find_one({"_id": ObjectId(manager_id)})
+    # Verify manager password (the manager must belong to the leave's organization)
+    manager = users_collection.find_one({"_id": ObjectId(manager_id), "org_id": leave.get("org_id", DEFAULT_ORG_ID)})
     if not manager or not verify_password(password, manager["hashed_password"]):
         raise HTTPException(status_code=401, detail="Invalid manager password. Please check your password and try again.")
     
@@ -159,10 +280,15 @@ def process_leave_action_with_password(leave_id: str, action: str, manager_id: s
     if comments:
         update_data["comments"] = comments
     
-    leaves_collection.update_one({"_id": ObjectId(leave_id)}, {"$set": update_data})
+    with write_session(manager_id, leave["employee_id"]) as session:
+        leaves_collection.update_one({"org_id": leave.get("org_id"), "_id": ObjectId(leave_id)}, {"$set": update_data}, session=session)
+    
+    emit_event(f"leave.{status}", {**leave, **update_data})
+    if status == "approved":
+        invalidate_calendar(leave.get("org_id", DEFAULT_ORG_ID), leave.get("employee_department"))
     
     # Notify employee
-    notify_employee(leave, status)
+    notify_employee(leave, status, comments)
     
     return {
         "status": status,
@@ -172,6 +298,7 @@ def process_leave_action_with_password(leave_id: str, action: str, manager_id: s
 
 @router.post("/approve-from-email")
 async def approve_from_email(
+    request: Request,
     leave_id: str = Form(...),
     manager_id: str = Form(...),
     password: str = Form(...),
@@ -181,9 +308,32 @@ async def approve_from_email(
     """
     Handle leave approval/rejection directly from AMP email with password verification
     """
+    # AMP retries replay the first successful answer; errors are not stored so they can be retried
+    # Idempotency records, rate limits and bcrypt are blocking work - keep them off the event loop serving live streams
+    key = derive_key("approve-from-email", leave_id, manager_id, action, password)
+    ip = client_ip(request)
+    return await run_in_threadpool(
+        run_idempotent,
+        key,
+        lambda: _approve_from_email(ip, leave_id, manager_id, password, action, comments),
+        should_store=lambda response: response.get("status") == "success"
+    )
+
+def _approve_from_email(ip: str, leave_id: str, manager_id: str, password: str, action: str, comments: str):
+    manager_key = f"manager:{manager_id}"
     try:
+        # Reject throttled callers before any bcrypt work; the manager is only charged for failed passwords
+        check_rate_limit(f"ip:{ip}")
+        check_lockout(manager_key)
+        
         # Use the password verification function
-        result = process_leave_action_with_password(leave_id, action, manager_id, password, comments)
+        try:
+            result = process_leave_action_with_password(leave_id, action, manager_id, password, comments)
+        except HTTPException as e:
+            if e.status_code == 401:
+                record_failure(manager_key)
+            raise
+        record_success(manager_key)
         
         # Return success response for AMP email
         return {
@@ -208,6 +358,7 @@ async def approve_from_email(
 
 @router.post("/approve-with-token")
 async def approve_with_token(
+    request: Request,
     token: str = Form(...),
     leave_id: str = Form(...),
     manager_id: str = Form(...),
@@ -219,7 +370,24 @@ async def approve_with_token(
     Handle leave approval from AMP email with token + password verification
     Enhanced security: Both token AND password required
     """
+    # The token is single-use, so a retried post would fail after the first one succeeded.
+    # Replay the stored answer instead; failures are not stored and can be retried.
+    key = derive_key("approve-with-token", token, leave_id, manager_id, action, password)
+    ip = client_ip(request)
+    return await run_in_threadpool(
+        run_idempotent,
+        key,
+        lambda: _approve_with_token(ip, token, leave_id, manager_id, password, action, comments),
+        should_store=lambda response: response.get("success") is True
+    )
+
+def _approve_with_token(ip: str, token: str, leave_id: str, manager_id: str, password: str, action: str, comments: str):
+    manager_key = f"manager:{manager_id}"
     try:
+        # Reject throttled callers before any bcrypt work; the manager is only charged for failed passwords
+        check_rate_limit(f"ip:{ip}")
+        check_lockout(manager_key)
+        
         print(f"🔧 DEBUG - Received approval request:")
         print(f"   Token: {token[:8]}...")
         print(f"   Leave ID: {leave_id}")
@@ -257,8 +425,11 @@ async def approve_with_token(
         print(f"   Password verification result: {password_valid}")
         
         if not password_valid:
+            record_failure(manager_key)
             raise HTTPException(status_code=401, detail="Invalid manager password. Please check your password and try again.")
         
+        record_success(manager_key)
+        
         # Process the leave action
         result = process_leave_action_with_password(leave_id, action, manager_id, password, comments)
         
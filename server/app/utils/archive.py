@@ -0,0 +1,70 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+from dotenv import load_dotenv
+from pymongo import ReplaceOne
+
+from app.models.db import (
+    leaves_collection, leaves_archive_collection,
+    leaves_read_collection, leaves_archive_read_collection
+)
+
+load_dotenv()
+
+# Decided leaves older than this move to the archive tier
+ARCHIVE_AFTER_MONTHS = int(os.getenv("ARCHIVE_AFTER_MONTHS", 6))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", 500))
+ARCHIVE_INTERVAL_SECONDS = int(os.getenv("ARCHIVE_INTERVAL_SECONDS", 3600))
+
+def archive_decided_leaves() -> int:
+    """
+    Move leaves decided more than ARCHIVE_AFTER_MONTHS ago to the archive collection
+    Works in batches: bulk upsert into the archive, then delete from the hot collection.
+    Upserting makes a batch safe to repeat if a run stops between the two steps.
+    Writes filter on the full (org_id, _id) shard key, as sharded upserts require.
+    
+    Returns:
+        Number of leaves archived
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=30 * ARCHIVE_AFTER_MONTHS)).isoformat()
+    archived = 0
+    
+    while True:
+        batch = list(leaves_collection.find({
+            "is_action_taken": True,
+            "action_timestamp": {"$lt": cutoff}
+        }).limit(ARCHIVE_BATCH_SIZE))
+        if not batch:
+            break
+        
+        archived_at = datetime.now(timezone.utc).isoformat()
+        leaves_archive_collection.bulk_write(
+            [ReplaceOne({"org_id": leave.get("org_id"), "_id": leave["_id"]}, {**leave, "archived_at": archived_at}, upsert=True)
+             for leave in batch],
+            ordered=False
+        )
+        leaves_collection.delete_many({"_id": {"$in": [leave["_id"] for leave in batch]}})
+        archived += len(batch)
+    
+    if archived:
+        print(f"Archived {archived} decided leave requests")
+    return archived
+
+def find_leaves(query: dict, include_archived: bool = False, session=None) -> list:
+    """
+    Find leaves in the hot collection, and in the archive as well when older history is requested
+    Reads go to secondaries when allowed (see app.models.db)
+    
+    Args:
+        query: MongoDB filter, applied to both tiers
+        include_archived: Also search leaves decided more than ARCHIVE_AFTER_MONTHS ago
+        session: Optional read_session for read-your-writes
+    
+    Returns:
+        Matching leaves, newest first
+    """
+    leaves = list(leaves_read_collection.find(query, session=session))
+    if include_archived:
+        leaves += list(leaves_archive_read_collection.find(query, session=session))
+    leaves.sort(key=lambda leave: leave.get("created_at") or "", reverse=True)
+    return leaves
@@ -1,10 +1,12 @@
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
-from fastapi import HTTPException, status, Depends
+from fastapi import HTTPException, status, Depends, Request
 from fastapi.security import OAuth2PasswordBearer
 import os
 from dotenv import load_dotenv
+from app.utils.rate_limit import check_rate_limit
+from app.models.db import DEFAULT_ORG_ID
 
 load_dotenv()
 
@@ -28,7 +30,7 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def verify_token(token: str = Depends(oauth2_scheme)):
+def decode_access_claims(token: str) -> dict:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -41,4 +43,33 @@ def verify_token(token: str = Depends(oauth2_scheme)):
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    return user_id
+    return payload
+
+def decode_access_token(token: str):
+    return decode_access_claims(token)["sub"]
+
+def _tenant(claims: dict) -> str:
+    org_id = claims.get("org") or DEFAULT_ORG_ID
+    # Every tenant-scoped request counts against its organization's rate limit,
+    # so one tenant's spike can't starve the others
+    check_rate_limit(f"org:{org_id}")
+    return org_id
+
+def verify_token(token: str = Depends(oauth2_scheme)):
+    return decode_access_token(token)
+
+def verify_org(token: str = Depends(oauth2_scheme)):
+    return _tenant(decode_access_claims(token))
+
+def _stream_token(request: Request):
+    # EventSource can't send headers, so streams also accept ?access_token=
+    authorization = request.headers.get("Authorization", "")
+    if authorization.lower().startswith("bearer "):
+        return authorization[7:]
+    return request.query_params.get("access_token", "")
+
+def verify_stream_token(request: Request):
+    return decode_access_token(_stream_token(request))
+
+def verify_stream_org(request: Request):
+    return _tenant(decode_access_claims(_stream_token(request)))
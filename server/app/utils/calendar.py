@@ -0,0 +1,151 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from app.models.db import leaves_read_collection
+
+load_dotenv()
+
+SECRET_KEY = os.getenv("SECRET_KEY") or ""
+
+# How long a worker trusts its cached ETag before checking the database again.
+# Approvals on this worker invalidate immediately; other workers catch up within this window.
+CALENDAR_CACHE_SECONDS = int(os.getenv("CALENDAR_CACHE_SECONDS", 60))
+
+# (org_id, department) -> {"etag", "checked_at", "body"}
+_feeds = {}
+_feeds_lock = threading.Lock()
+
+def calendar_feed_key(org_id: str, department: str) -> str:
+    """
+    Secret part of a feed URL - calendar apps can't send a JWT, so the URL itself is the credential
+    """
+    return hmac.new(SECRET_KEY.encode(), f"calendar:{org_id}:{department}".encode(), hashlib.sha256).hexdigest()[:32]
+
+def invalidate_calendar(org_id: str, department: Optional[str]):
+    """
+    Drop the cached feed of a department after one of its leaves was approved
+    """
+    with _feeds_lock:
+        _feeds.pop((org_id, department), None)
+
+def _approved_query(org_id: str, department: str) -> dict:
+    return {"org_id": org_id, "employee_department": department, "status": "approved"}
+
+def _compute_etag(org_id: str, department: str) -> str:
+    latest = leaves_read_collection.find_one(
+        _approved_query(org_id, department),
+        projection={"action_timestamp": 1},
+        sort=[("action_timestamp", -1)]
+    )
+    count = leaves_read_collection.count_documents(_approved_query(org_id, department))
+    latest_timestamp = latest.get("action_timestamp") if latest else None
+    digest = hashlib.sha256(f"{org_id}|{department}|{latest_timestamp}|{count}".encode()).hexdigest()[:32]
+    return f'"{digest}"'
+
+def get_calendar_etag(org_id: str, department: str) -> str:
+    """
+    Strong ETag of a department feed, derived from the latest approval and the number of approved leaves
+    Feeds are read from secondaries when allowed, so they may lag by MONGODB_MAX_STALENESS_SECONDS
+    """
+    now = time.monotonic()
+    with _feeds_lock:
+        feed = _feeds.get((org_id, department))
+        if feed and now - feed["checked_at"] < CALENDAR_CACHE_SECONDS:
+            return feed["etag"]
+    
+    etag = _compute_etag(org_id, department)
+    with _feeds_lock:
+        feed = _feeds.get((org_id, department))
+        if feed and feed["etag"] == etag:
+            feed["checked_at"] = now
+        else:
+            _feeds[(org_id, department)] = {"etag": etag, "checked_at": now, "body": None}
+    return etag
+
+def get_calendar_body(org_id: str, department: str, etag: str) -> str:
+    """
+    Rendered iCalendar feed matching the given ETag, rendered at most once per ETag
+    """
+    with _feeds_lock:
+        feed = _feeds.get((org_id, department))
+        if feed and feed["etag"] == etag and feed["body"] is not None:
+            return feed["body"]
+    
+    leaves = leaves_read_collection.find(
+        _approved_query(org_id, department),
+        projection={"employee_name": 1, "leave_type": 1, "start_date": 1, "end_date": 1, "action_timestamp": 1}
+    ).sort("start_date", 1)
+    body = render_calendar(department, leaves)
+    
+    with _feeds_lock:
+        feed = _feeds.get((org_id, department))
+        if feed and feed["etag"] == etag:
+            feed["body"] = body
+    return body
+
+def _escape(text) -> str:
+    return (str(text or "").replace("\\", "\\\\").replace(";", "\\;")
+            .replace(",", "\\,").replace("\r\n", "\\n").replace("\n", "\\n"))
+
+def _fold(line: str) -> str:
+    # RFC 5545 limits content lines to 75 octets; continuation lines start with a space
+    encoded = line.encode()
+    if len(encoded) <= 75:
+        return line
+    parts = []
+    while encoded:
+        limit = 75 if not parts else 74
+        cut = min(limit, len(encoded))
+        # Never split a UTF-8 sequence
+        while cut < len(encoded) and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode())
+        encoded = encoded[cut:]
+    return "\r\n ".join(parts)
+
+def _timestamp(value: Optional[str]) -> str:
+    try:
+        moment = datetime.fromisoformat(value).astimezone(timezone.utc)
+    except (TypeError, ValueError):
+        moment = datetime.now(timezone.utc)
+    return moment.strftime("%Y%m%dT%H%M%SZ")
+
+def render_calendar(department: str, leaves) -> str:
+    """
+    Render approved leaves as all-day events of an iCalendar feed
+    """
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//Leave Approval System//Team Calendar//EN",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        f"X-WR-CALNAME:{_escape(department)} - Leave",
+    ]
+    for leave in leaves:
+        try:
+            start = date.fromisoformat(str(leave["start_date"])[:10])
+            end = date.fromisoformat(str(leave["end_date"])[:10])
+        except (KeyError, ValueError):
+            continue
+        
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:{leave['_id']}@leave-approval",
+            f"DTSTAMP:{_timestamp(leave.get('action_timestamp'))}",
+            f"DTSTART;VALUE=DATE:{start.strftime('%Y%m%d')}",
+            # DTEND is exclusive for all-day events
+            f"DTEND;VALUE=DATE:{(max(start, end) + timedelta(days=1)).strftime('%Y%m%d')}",
+            f"SUMMARY:{_escape(leave.get('employee_name', 'Employee'))} - {_escape(leave.get('leave_type', 'Leave'))}",
+            "TRANSP:TRANSPARENT",
+            "END:VEVENT",
+        ]
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(_fold(line) for line in lines) + "\r\n"
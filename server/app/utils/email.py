@@ -1,9 +1,11 @@
 import os
 from email.message import EmailMessage
 import smtplib
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemLoader, select_autoescape
 from dotenv import load_dotenv
 from app.utils.tokens import generate_approval_token
+from app.models.db import DEFAULT_ORG_ID
+from app.utils.resilience import smtp_breaker, tokens_breaker
 
 load_dotenv()
 
@@ -11,19 +13,48 @@ EMAIL_HOST = os.getenv("EMAIL_HOST")
 EMAIL_PORT = int(os.getenv("EMAIL_PORT", 587))
 EMAIL_USER = os.getenv("EMAIL_USER")
 EMAIL_PASS = os.getenv("EMAIL_PASS")
+EMAIL_USE_TLS = os.getenv("EMAIL_USE_TLS", "true").lower() == "true"
+# Deadline for connecting and for each SMTP command
+EMAIL_TIMEOUT_SECONDS = float(os.getenv("EMAIL_TIMEOUT_SECONDS", 10))
 
 # URL Configuration for deployment
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:5173")
 
-env = Environment(loader=FileSystemLoader("app/utils/templates"))
+# Templates render user-supplied text (reasons, comments, leave types), so HTML is always escaped
+env = Environment(loader=FileSystemLoader("app/utils/templates"), autoescape=select_autoescape(["html"]))
 
-def send_leave_action_email(leave_dict):
+def email_configured():
+    return all([EMAIL_HOST, EMAIL_USER, EMAIL_PASS])
+
+def _smtp_send(msg):
+    with smtplib.SMTP(EMAIL_HOST, EMAIL_PORT, timeout=EMAIL_TIMEOUT_SECONDS) as server:
+        if EMAIL_USE_TLS:
+            server.starttls()
+        server.login(EMAIL_USER, EMAIL_PASS)
+        server.send_message(msg)
+
+def send_message(msg):
+    # Raises CircuitOpenError without connecting while the SMTP relay keeps failing
+    smtp_breaker.call(_smtp_send, msg)
+
+def send_leave_action_email(leave_dict, subject_prefix=""):
+    """
+    Send the approval email (AMP + HTML fallback) with fresh one-time tokens to the manager
+    
+    Returns:
+        True if the email was sent, False otherwise
+    """
     try:
         # Check if email configuration is available
-        if not all([EMAIL_HOST, EMAIL_USER, EMAIL_PASS]):
+        if not email_configured():
             print("Email configuration not available, skipping email notification")
-            return
+            return False
+        
+        # Don't mint tokens for an email that can't be sent right now
+        if smtp_breaker.is_open() or tokens_breaker.is_open():
+            print("Email or token service unavailable (circuit open), skipping email notification")
+            return False
         
         # Validate URL configuration
         if not BACKEND_URL or not FRONTEND_URL:
@@ -55,8 +86,9 @@ def send_leave_action_email(leave_dict):
         manager_id = str(leave_dict['manager_id'])
         
         # Generate tokens (24 hours validity)
-        approval_token = generate_approval_token(leave_id, manager_id, "approve", 24)
-        rejection_token = generate_approval_token(leave_id, manager_id, "reject", 24)
+        org_id = leave_dict.get("org_id", DEFAULT_ORG_ID)
+        approval_token = generate_approval_token(leave_id, manager_id, "approve", 24, org_id)
+        rejection_token = generate_approval_token(leave_id, manager_id, "reject", 24, org_id)
         
         # Add tokens to leave_dict for template
         leave_dict['approval_token'] = approval_token
@@ -81,7 +113,7 @@ def send_leave_action_email(leave_dict):
         html_content = html_template.render(leave=leave_dict)
         
         msg = EmailMessage()
-        msg["Subject"] = f"Leave Request {leave_dict.get('status', 'Approval').title()} - {leave_dict.get('employee_name', 'Employee')}"
+        msg["Subject"] = f"{subject_prefix}Leave Request {leave_dict.get('status', 'Approval').title()} - {leave_dict.get('employee_name', 'Employee')}"
         msg["From"] = EMAIL_USER
         msg["To"] = leave_dict["manager_email"]
         
@@ -90,21 +122,48 @@ def send_leave_action_email(leave_dict):
         msg.add_alternative(html_content, subtype="html")
         msg.add_alternative(amp_content, subtype="x-amp-html")
         
-        with smtplib.SMTP(EMAIL_HOST, EMAIL_PORT) as server:
-            server.starttls()
-            server.login(EMAIL_USER, EMAIL_PASS)
-            server.send_message(msg)
+        send_message(msg)
         
         status_text = leave_dict.get('status', 'pending')
         print(f"Multi-format email notification sent successfully for {status_text} leave request from {leave_dict.get('employee_name', 'Employee')}")
         print(f"Email formats: HTML (fallback) + AMP (interactive) sent to {leave_dict['manager_email']}")
         print(f"Generated tokens - Approval: {approval_token[:8]}..., Rejection: {rejection_token[:8]}...")
+        return True
         
     except Exception as e:
         # Log the error but don't fail the leave submission
         print(f"Failed to send email notification: {str(e)}")
         print("Leave request was still processed successfully")
+        return False
+
+def send_decision_email(recipient, employee_name, decisions):
+    """
+    Send one email summarising one or more leave decisions to an employee
+    Unlike send_leave_action_email this raises on failure so the caller can retry
+    """
+    template = env.get_template("leave_decision.html")
+    html_content = template.render(employee_name=employee_name, decisions=decisions, frontend_url=FRONTEND_URL)
+    
+    if len(decisions) == 1:
+        subject = f"Your leave request was {decisions[0]['status']}"
+    else:
+        subject = f"Updates on {len(decisions)} of your leave requests"
+    
+    msg = EmailMessage()
+    msg["Subject"] = subject
+    msg["From"] = EMAIL_USER
+    msg["To"] = recipient
+    msg.set_content("Please enable HTML to view this email properly.")
+    msg.add_alternative(html_content, subtype="html")
+    
+    send_message(msg)
 
-def notify_employee(leave, action):
+def notify_employee(leave, action, comments=None):
     # Notify employee of status change
-    pass  # Implement as needed
+    # Only queues the notification - delivery happens in the background (see app.utils.notifications)
+    from app.utils.notifications import enqueue_decision
+    try:
+        enqueue_decision(leave, action, comments)
+    except Exception as e:
+        # The decision itself is already stored, a lost notification must not fail it
+        print(f"Failed to queue employee notification: {str(e)}")
@@ -0,0 +1,247 @@
+import hashlib
+import hmac
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import httpx
+from bson import ObjectId
+from dotenv import load_dotenv
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.models.db import (
+    events_collection, counters_collection,
+    webhook_state_collection, webhook_dead_letters_collection, DEFAULT_ORG_ID
+)
+from app.utils.live import publish_local
+
+load_dotenv()
+
+# Comma separated list of endpoints receiving the event stream, each "org_id=url" or just "url" for DEFAULT_ORG_ID.
+# A subscriber only receives its own organization's events.
+WEBHOOK_URLS = [url.strip() for url in os.getenv("WEBHOOK_URLS", "").split(",") if url.strip()]
+# Shared with the receivers - never fall back to SECRET_KEY, which signs access tokens
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or ""
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", 100))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", 8))
+WEBHOOK_RETRY_BASE_SECONDS = int(os.getenv("WEBHOOK_RETRY_BASE_SECONDS", 10))
+WEBHOOK_DISPATCH_INTERVAL_SECONDS = int(os.getenv("WEBHOOK_DISPATCH_INTERVAL_SECONDS", 5))
+
+# Sequence numbers are allocated before the insert, so a lower number can land after a higher one.
+# Allocated numbers are listed on the counter until their event is stored, and readers never read past
+# the lowest one. A number still listed after this long is given up on (its writer crashed or stalled).
+SEQ_ABANDON_SECONDS = int(os.getenv("EVENT_SEQ_ABANDON_SECONDS", 30))
+
+# Placeholder stored for a given-up sequence number, never returned to readers
+GAP_EVENT_TYPE = "gap"
+
+# Leave fields copied into event payloads
+EVENT_LEAVE_FIELDS = [
+    "employee_id", "employee_name", "employee_email", "employee_department",
+    "manager_id", "manager_email", "leave_type", "start_date", "end_date",
+    "status", "created_at", "action_timestamp", "processed_via"
+]
+
+def _allocate_seq() -> int:
+    # Increment and record the number as pending in one atomic update
+    counter = counters_collection.find_one_and_update(
+        {"_id": "leave_events"},
+        [
+            {"$set": {"seq": {"$add": [{"$ifNull": ["$seq", 0]}, 1]}}},
+            {"$set": {"pending": {"$concatArrays": [
+                {"$ifNull": ["$pending", []]},
+                [{"seq": "$seq", "allocated_at": "$$NOW"}]
+            ]}}}
+        ],
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return counter["seq"]
+
+def _release_seq(seq: int):
+    counters_collection.update_one({"_id": "leave_events"}, {"$pull": {"pending": {"seq": seq}}})
+
+def _readable_until() -> int:
+    """
+    Highest sequence number below which every event is stored (or given up on)
+    """
+    counter = counters_collection.find_one({"_id": "leave_events"})
+    if not counter:
+        return 0
+    
+    limit = counter.get("seq", 0)
+    abandon_before = datetime.now(timezone.utc) - timedelta(seconds=SEQ_ABANDON_SECONDS)
+    for entry in counter.get("pending", []):
+        if entry["allocated_at"].replace(tzinfo=timezone.utc) <= abandon_before:
+            # Claim the number with a placeholder; the unique seq index makes a late writer take a new one
+            try:
+                events_collection.insert_one({"seq": entry["seq"], "type": GAP_EVENT_TYPE, "created_at": datetime.now(timezone.utc)})
+                print(f"Gave up on event sequence number {entry['seq']}")
+            except DuplicateKeyError:
+                pass
+            _release_seq(entry["seq"])
+        else:
+            limit = min(limit, entry["seq"] - 1)
+    return limit
+
+def emit_event(event_type: str, leave: dict):
+    """
+    Append a lifecycle event to the event log
+    Never raises - the state change that triggered the event is already stored
+
+    Args:
+        event_type: e.g. "leave.submitted", "leave.approved", "leave.rejected", "leave.escalated"
+        leave: Leave document after the change
+    """
+    try:
+        data = {}
+        for field in EVENT_LEAVE_FIELDS:
+            value = leave.get(field)
+            data[field] = str(value) if isinstance(value, ObjectId) else value
+        
+        for _ in range(3):
+            seq = _allocate_seq()
+            try:
+                events_collection.insert_one({
+                    "seq": seq,
+                    "org_id": leave.get("org_id", DEFAULT_ORG_ID),
+                    "type": event_type,
+                    "leave_id": str(leave["_id"]),
+                    "data": data,
+                    "created_at": datetime.now(timezone.utc)
+                })
+                break
+            except DuplicateKeyError:
+                # A reader gave up waiting for this number - take a fresh one
+                continue
+            finally:
+                _release_seq(seq)
+        else:
+            print(f"Failed to record {event_type} event: no free sequence number")
+    except Exception as e:
+        print(f"Failed to record {event_type} event: {str(e)}")
+    
+    # Keeps manager dashboards live when change streams are not available
+    publish_local(leave)
+
+def serialize_event(event: dict) -> dict:
+    return {
+        "id": str(event["seq"]),
+        "org_id": event.get("org_id", DEFAULT_ORG_ID),
+        "type": event["type"],
+        "leave_id": event["leave_id"],
+        "data": event["data"],
+        "created_at": event["created_at"].replace(tzinfo=timezone.utc).isoformat()
+    }
+
+def list_events(after: int = 0, limit: int = 100, org_id: Optional[str] = None) -> list:
+    """
+    Read events after a cursor, oldest first
+
+    Args:
+        after: Sequence number of the last event already seen (0 for the beginning)
+        limit: Maximum number of events returned
+        org_id: Only return events of this organization (all organizations if None)
+
+    Returns:
+        Serialized events; the id of the last one is the next cursor
+    """
+    query = {"seq": {"$gt": after, "$lte": _readable_until()}, "type": {"$ne": GAP_EVENT_TYPE}}
+    if org_id is not None:
+        query = {"org_id": org_id, **query}
+    events = events_collection.find(query).sort("seq", 1).limit(limit)
+    return [serialize_event(event) for event in events]
+
+def parse_subscription(entry: str) -> tuple:
+    """
+    Split a WEBHOOK_URLS entry into (org_id, url)
+    """
+    org_id, separator, url = entry.partition("=")
+    if not separator or ":" in org_id:
+        # No organization prefix (the "=" belongs to the URL's query string, if any)
+        return DEFAULT_ORG_ID, entry
+    return org_id.strip(), url.strip()
+
+def webhook_secret(org_id: str) -> str:
+    """
+    Signing secret handed to an organization's webhook receivers
+    Derived per organization, so one tenant's receiver can't forge payloads for another's
+    """
+    return hmac.new(WEBHOOK_SECRET.encode(), f"webhook:{org_id}".encode(), hashlib.sha256).hexdigest()
+
+def sign_payload(body: bytes, timestamp: int, org_id: str = DEFAULT_ORG_ID) -> str:
+    """
+    Signature sent in the X-Leave-Signature header
+    Receivers recompute HMAC-SHA256(webhook_secret(org_id), "<timestamp>.<body>") and compare
+    """
+    digest = hmac.new(webhook_secret(org_id).encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+def _post_batch(url: str, events: list, org_id: str):
+    body = json.dumps({"events": events}).encode()
+    timestamp = int(time.time())
+    response = httpx.post(url, content=body, timeout=10, headers={
+        "Content-Type": "application/json",
+        "X-Leave-Signature": sign_payload(body, timestamp, org_id)
+    })
+    response.raise_for_status()
+
+def _deliver_to(org_id: str, url: str, now: datetime):
+    # Default-organization subscribers keep the cursor they had before subscriptions were per organization
+    subscription_id = url if org_id == DEFAULT_ORG_ID else f"{org_id}={url}"
+    state = webhook_state_collection.find_one({"_id": subscription_id}) or {"_id": subscription_id, "org_id": org_id, "cursor": 0, "failures": 0}
+    next_attempt_at = state.get("next_attempt_at")
+    if next_attempt_at and next_attempt_at.replace(tzinfo=timezone.utc) > now:
+        return
+    
+    while True:
+        events = list_events(state["cursor"], WEBHOOK_BATCH_SIZE, org_id)
+        if not events:
+            return
+        
+        last_seq = int(events[-1]["id"])
+        try:
+            _post_batch(url, events, org_id)
+            state.update({"cursor": last_seq, "failures": 0, "next_attempt_at": None})
+        except Exception as e:
+            failures = state.get("failures", 0) + 1
+            print(f"Webhook delivery to {url} failed ({failures}/{WEBHOOK_MAX_ATTEMPTS}): {str(e)}")
+            if failures >= WEBHOOK_MAX_ATTEMPTS:
+                # Park the batch so one bad batch doesn't block the stream forever
+                webhook_dead_letters_collection.insert_one({
+                    "org_id": org_id,
+                    "url": url,
+                    "events": events,
+                    "error": str(e),
+                    "created_at": now
+                })
+                state.update({"cursor": last_seq, "failures": 0, "next_attempt_at": None})
+            else:
+                state.update({
+                    "failures": failures,
+                    "next_attempt_at": now + timedelta(seconds=WEBHOOK_RETRY_BASE_SECONDS * 2 ** (failures - 1))
+                })
+                webhook_state_collection.replace_one({"_id": subscription_id}, state, upsert=True)
+                return
+        webhook_state_collection.replace_one({"_id": subscription_id}, state, upsert=True)
+
+def deliver_webhooks():
+    """
+    Push new events to every configured webhook in signed batches, each only its organization's events
+    Each subscriber keeps its own cursor, so a failing one doesn't hold back the others
+    """
+    if WEBHOOK_URLS and not WEBHOOK_SECRET:
+        # Cursors stay where they are, so nothing is lost once the secret is configured
+        print("WEBHOOK_SECRET is not set - skipping webhook delivery")
+        return
+    
+    now = datetime.now(timezone.utc)
+    for entry in WEBHOOK_URLS:
+        org_id, url = parse_subscription(entry)
+        try:
+            _deliver_to(org_id, url, now)
+        except Exception as e:
+            print(f"Webhook dispatch for {url} failed: {str(e)}")
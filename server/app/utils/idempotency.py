@@ -0,0 +1,163 @@
+import hashlib
+import hmac
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from pymongo.errors import DuplicateKeyError
+
+from app.models.db import idempotency_collection
+
+load_dotenv()
+
+SECRET_KEY = os.getenv("SECRET_KEY") or ""
+IDEMPOTENCY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_TTL_HOURS", 24))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", 10000))
+
+# How long a reservation may stay "in progress" before another attempt may take it over
+IN_PROGRESS_TIMEOUT = timedelta(minutes=2)
+
+# Process-local cache of completed responses: key -> (expires_at, response)
+_completed_cache: "OrderedDict[str, tuple]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+def derive_key(scope: str, *parts) -> str:
+    """
+    Build an idempotency key for an endpoint
+
+    The key is an HMAC over the scope and the identifying parts of the request,
+    so secrets such as tokens or passwords can take part in the key without
+    ever being stored in the database.
+
+    Args:
+        scope: Name of the operation (e.g. "submit", "approve-with-token")
+        parts: Values identifying the request (user id, client key, payload...)
+
+    Returns:
+        Hex digest usable as the idempotency record id
+    """
+    message = "\x1f".join([scope] + [str(part) for part in parts])
+    return hmac.new(SECRET_KEY.encode(), message.encode(), hashlib.sha256).hexdigest()
+
+def _cache_get(key: str) -> Optional[dict]:
+    with _cache_lock:
+        entry = _completed_cache.get(key)
+        if not entry:
+            return None
+        expires_at, response = entry
+        if expires_at <= datetime.now(timezone.utc):
+            del _completed_cache[key]
+            return None
+        _completed_cache.move_to_end(key)
+        return response
+
+def _cache_put(key: str, expires_at: datetime, response: dict):
+    with _cache_lock:
+        _completed_cache[key] = (expires_at, response)
+        _completed_cache.move_to_end(key)
+        while len(_completed_cache) > IDEMPOTENCY_CACHE_SIZE:
+            _completed_cache.popitem(last=False)
+
+def begin_request(key: str) -> Optional[dict]:
+    """
+    Reserve an idempotency key before doing the actual work
+
+    Args:
+        key: Idempotency key from derive_key
+
+    Returns:
+        The stored response if this request was already completed, None if the
+        caller now owns the key and should process the request
+
+    Raises:
+        HTTPException 409 if the same request is still being processed
+    """
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
+    now = datetime.now(timezone.utc)
+    try:
+        idempotency_collection.insert_one({
+            "_id": key,
+            "state": "in_progress",
+            "created_at": now,
+            "expires_at": now + IN_PROGRESS_TIMEOUT
+        })
+        return None
+    except DuplicateKeyError:
+        pass
+
+    record = idempotency_collection.find_one({"_id": key})
+    if record and record.get("state") == "completed":
+        expires_at = record["expires_at"].replace(tzinfo=timezone.utc)
+        _cache_put(key, expires_at, record["response"])
+        return record["response"]
+
+    # The reservation went stale (worker died mid-request) or expired between the two calls
+    taken_over = idempotency_collection.find_one_and_update(
+        {"_id": key, "state": "in_progress", "expires_at": {"$lte": now}},
+        {"$set": {"created_at": now, "expires_at": now + IN_PROGRESS_TIMEOUT}}
+    )
+    if taken_over or record is None:
+        return None
+
+    raise HTTPException(status_code=409, detail="This request is already being processed. Please wait a moment.")
+
+def complete_request(key: str, response: dict):
+    """
+    Store the response for a reserved key so retries can be replayed
+
+    Args:
+        key: Idempotency key owned by the caller
+        response: JSON-serialisable response returned to the client
+    """
+    expires_at = datetime.now(timezone.utc) + timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+    idempotency_collection.update_one(
+        {"_id": key},
+        {"$set": {"state": "completed", "response": response, "expires_at": expires_at}},
+        upsert=True
+    )
+    _cache_put(key, expires_at, response)
+
+def release_request(key: str):
+    """
+    Drop a reservation so the request can be retried (used when processing failed)
+
+    Args:
+        key: Idempotency key owned by the caller
+    """
+    idempotency_collection.delete_one({"_id": key, "state": "in_progress"})
+
+def run_idempotent(key: str, handler: Callable[[], dict], should_store: Callable[[dict], bool] = lambda response: True) -> dict:
+    """
+    Run a handler at most once per idempotency key and replay its response on retries
+
+    Args:
+        key: Idempotency key from derive_key
+        handler: Function doing the actual work and returning the response
+        should_store: Decides whether a response is final and may be replayed;
+            responses rejected here release the key so the client can retry
+
+    Returns:
+        The handler's response, or the stored one for a retried request
+    """
+    replay = begin_request(key)
+    if replay is not None:
+        return replay
+
+    try:
+        response = handler()
+    except BaseException:
+        release_request(key)
+        raise
+
+    if should_store(response):
+        complete_request(key, response)
+    else:
+        release_request(key)
+    return response
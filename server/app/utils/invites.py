@@ -0,0 +1,94 @@
+import hashlib
+import os
+import secrets
+import sys
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+
+from app.models.db import invites_collection
+
+load_dotenv()
+
+INVITE_TTL_DAYS = int(os.getenv("INVITE_TTL_DAYS", 7))
+
+ROLES = ("employee", "manager", "hr")
+
+def _invite_id(code: str) -> str:
+    # Only a hash is stored, so a database read doesn't hand out working invites
+    return hashlib.sha256(code.encode()).hexdigest()
+
+def create_invite(org_id: str, role: str = "employee", email: Optional[str] = None, created_by: Optional[str] = None) -> str:
+    """
+    Create a one-time invite into an organization
+
+    Args:
+        org_id: Organization the invited user joins
+        role: Role the invited user gets ("employee", "manager" or "hr")
+        email: Only this email address may use the invite (any address if None)
+        created_by: User id of the inviting HR user (None for invites created by an operator)
+
+    Returns:
+        The invite code to hand to the user
+    """
+    if role not in ROLES:
+        raise ValueError(f"Unknown role: {role}")
+
+    code = secrets.token_urlsafe(24)
+    now = datetime.now(timezone.utc)
+    invites_collection.insert_one({
+        "_id": _invite_id(code),
+        "org_id": org_id,
+        "role": role,
+        "email": email.lower() if email else None,
+        "created_by": created_by,
+        "created_at": now,
+        "expires_at": now + timedelta(days=INVITE_TTL_DAYS),
+        "used_at": None
+    })
+    return code
+
+def redeem_invite(code: str, email: str) -> dict:
+    """
+    Use up an invite during registration
+
+    Args:
+        code: Invite code from create_invite
+        email: Email address the user registers with
+
+    Returns:
+        The invite document, holding the org_id and role to assign
+
+    Raises:
+        HTTPException 400 if the invite is unknown, expired, used or meant for another address
+    """
+    now = datetime.now(timezone.utc)
+    invite = invites_collection.find_one_and_update(
+        {
+            "_id": _invite_id(code),
+            "used_at": None,
+            "expires_at": {"$gt": now},
+            "email": {"$in": [None, email.lower()]}
+        },
+        {"$set": {"used_at": now}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not invite:
+        raise HTTPException(status_code=400, detail="Invalid or expired invite code")
+    return invite
+
+def release_invite(code: str):
+    """
+    Make an invite usable again (used when registration failed after redeeming it)
+    """
+    invites_collection.update_one({"_id": _invite_id(code)}, {"$set": {"used_at": None}})
+
+if __name__ == "__main__":
+    # Bootstrap a new organization: python -m app.utils.invites <org_id> [role] [email]
+    if len(sys.argv) < 2:
+        print("Usage: python -m app.utils.invites <org_id> [role] [email]")
+        sys.exit(1)
+    print(create_invite(sys.argv[1], *sys.argv[2:4]))
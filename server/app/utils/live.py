@@ -0,0 +1,134 @@
+import asyncio
+import threading
+import time
+from collections import defaultdict
+from typing import Optional
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from app.models.db import leaves_collection
+from app.utils.serializers import serialize_leave
+
+# Per-connection buffer; a client that falls this far behind is told to reload instead
+QUEUE_SIZE = 100
+
+# Changes to these fields can move a leave in or out of a manager's pending queue
+QUEUE_FIELDS = {"status", "is_action_taken", "manager_id"}
+
+class PendingQueueHub:
+    """
+    In-process pub/sub fanning out pending-queue changes to the SSE connections of this worker
+    Idle connections are parked asyncio queues, so they cost no CPU until something is published
+    """
+
+    def __init__(self):
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.subscribers = defaultdict(set)
+        # True while the change stream feeds the hub; otherwise the write paths publish directly
+        self.change_stream_active = False
+
+    def subscribe(self, manager_id: str) -> asyncio.Queue:
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.subscribers[manager_id].add(queue)
+        return queue
+
+    def unsubscribe(self, manager_id: str, queue: asyncio.Queue):
+        queues = self.subscribers.get(manager_id)
+        if queues:
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[manager_id]
+
+    def _deliver(self, manager_id: str, event: dict):
+        for queue in self.subscribers.get(manager_id, ()):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({"type": "resync", "data": {}})
+
+    def publish(self, manager_id: str, event: dict):
+        """
+        Thread-safe: may be called from request threads or the change stream thread
+        """
+        if self.loop is None or manager_id not in self.subscribers:
+            return
+        self.loop.call_soon_threadsafe(self._deliver, manager_id, event)
+
+hub = PendingQueueHub()
+
+def _is_pending(leave: dict) -> bool:
+    return leave.get("status") == "pending" and not leave.get("is_action_taken")
+
+def publish_leave_change(leave: dict):
+    """
+    Tell the leave's manager (and a previous manager after an escalation)
+    whether the leave is now in or out of their pending queue
+    """
+    leave = serialize_leave(leave)
+    if _is_pending(leave):
+        hub.publish(leave["manager_id"], {"type": "add", "data": leave})
+    else:
+        hub.publish(leave["manager_id"], {"type": "remove", "data": {"_id": leave["_id"]}})
+    
+    if leave.get("escalated_from") and leave["escalated_from"] != leave["manager_id"]:
+        hub.publish(leave["escalated_from"], {"type": "remove", "data": {"_id": leave["_id"]}})
+
+def publish_local(leave: dict):
+    """
+    Fallback feed used by the write paths when no change stream is running
+    Only reaches connections on this worker
+    """
+    if not hub.change_stream_active:
+        publish_leave_change(leave)
+
+def _watch_changes(stop: threading.Event):
+    resume_token = None
+    pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}}]
+    while not stop.is_set():
+        try:
+            with leaves_collection.watch(pipeline, full_document="updateLookup", resume_after=resume_token) as stream:
+                hub.change_stream_active = True
+                print("Listening to leave changes through a change stream")
+                while not stop.is_set():
+                    change = stream.try_next()
+                    if change is None:
+                        continue
+                    resume_token = stream.resume_token
+                    
+                    if change["operationType"] == "update":
+                        updated = set(change["updateDescription"]["updatedFields"])
+                        if not updated & QUEUE_FIELDS:
+                            continue
+                    if change.get("fullDocument"):
+                        publish_leave_change(change["fullDocument"])
+        except OperationFailure as e:
+            hub.change_stream_active = False
+            if resume_token is not None:
+                # The resume point fell out of the oplog - start over from now
+                resume_token = None
+                continue
+            # Standalone servers don't support change streams - stay on the in-process feed
+            print(f"Change streams unavailable, using in-process updates: {str(e)}")
+            return
+        except PyMongoError as e:
+            hub.change_stream_active = False
+            print(f"Change stream interrupted, retrying: {str(e)}")
+            time.sleep(5)
+    hub.change_stream_active = False
+
+_stop_watching = threading.Event()
+
+def start_change_listener(loop: asyncio.AbstractEventLoop):
+    """
+    Start the single change stream of this worker in a background thread
+    """
+    hub.loop = loop
+    _stop_watching.clear()
+    threading.Thread(target=_watch_changes, args=(_stop_watching,), name="leave-change-stream", daemon=True).start()
+
+def stop_change_listener():
+    _stop_watching.set()
@@ -0,0 +1,173 @@
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import httpx
+from dotenv import load_dotenv
+from pymongo import ReturnDocument
+
+from app.models.db import notifications_collection
+from app.utils.email import send_decision_email, email_configured
+from app.utils.scheduler import WORKER_ID
+
+load_dotenv()
+
+# Optional endpoint receiving every decision as JSON (e.g. a chat integration)
+NOTIFICATION_WEBHOOK_URL = os.getenv("NOTIFICATION_WEBHOOK_URL")
+
+NOTIFICATION_DISPATCH_INTERVAL_SECONDS = int(os.getenv("NOTIFICATION_DISPATCH_INTERVAL_SECONDS", 10))
+NOTIFICATION_BATCH_SIZE = int(os.getenv("NOTIFICATION_BATCH_SIZE", 200))
+NOTIFICATION_MAX_ATTEMPTS = int(os.getenv("NOTIFICATION_MAX_ATTEMPTS", 8))
+NOTIFICATION_RETRY_BASE_SECONDS = int(os.getenv("NOTIFICATION_RETRY_BASE_SECONDS", 30))
+
+# A claimed notification goes back to the queue if its worker died while sending.
+# Claims are renewed before each recipient's messages, so a long batch never outlives its claim.
+CLAIM_TIMEOUT = timedelta(minutes=5)
+
+def _channels():
+    channels = []
+    if email_configured():
+        channels.append("email")
+    if NOTIFICATION_WEBHOOK_URL:
+        channels.append("webhook")
+    return channels
+
+def enqueue_decision(leave: dict, status: str, comments: Optional[str] = None):
+    """
+    Queue a decision notification for the employee
+    Called after the leave update is stored, so the approver never waits on delivery
+
+    Args:
+        leave: The leave document
+        status: "approved" or "rejected"
+        comments: Optional approver comments
+    """
+    channels = _channels()
+    if not channels or not leave.get("employee_email"):
+        print("No notification channel configured, skipping employee notification")
+        return
+    
+    now = datetime.now(timezone.utc)
+    notifications_collection.insert_one({
+        "recipient": leave["employee_email"],
+        "employee_name": leave.get("employee_name", "there"),
+        "leave_id": str(leave["_id"]),
+        "leave_type": leave.get("leave_type"),
+        "start_date": leave.get("start_date"),
+        "end_date": leave.get("end_date"),
+        "status": status,
+        "comments": comments,
+        "pending_channels": channels,
+        "state": "pending",
+        "attempts": 0,
+        "next_attempt_at": now,
+        "created_at": now
+    })
+
+def _claim_due(now: datetime) -> list:
+    """
+    Claim up to NOTIFICATION_BATCH_SIZE due notifications for this worker
+    Each claim is atomic, so concurrent workers never pick the same notification
+    """
+    claimed = []
+    while len(claimed) < NOTIFICATION_BATCH_SIZE:
+        doc = notifications_collection.find_one_and_update(
+            {"$or": [
+                {"state": "pending", "next_attempt_at": {"$lte": now}},
+                {"state": "sending", "next_attempt_at": {"$lte": now - CLAIM_TIMEOUT}}
+            ]},
+            {"$set": {"state": "sending", "claimed_by": WORKER_ID, "next_attempt_at": now}},
+            sort=[("next_attempt_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+        if not doc:
+            break
+        claimed.append(doc)
+    return claimed
+
+def _renew_claim(notifications: list) -> list:
+    """
+    Extend this worker's claim on a recipient's notifications right before sending them
+
+    Returns:
+        The notifications still claimed by this worker (others were taken over and are skipped)
+    """
+    ids = [n["_id"] for n in notifications]
+    owned = {"_id": {"$in": ids}, "state": "sending", "claimed_by": WORKER_ID}
+    notifications_collection.update_many(owned, {"$set": {"next_attempt_at": datetime.now(timezone.utc)}})
+    still_owned = {doc["_id"] for doc in notifications_collection.find(owned, projection={"_id": 1})}
+    return [n for n in notifications if n["_id"] in still_owned]
+
+def _deliver(channel: str, recipient: str, notifications: list):
+    decisions = [{
+        "leave_id": n["leave_id"],
+        "leave_type": n.get("leave_type"),
+        "start_date": n.get("start_date"),
+        "end_date": n.get("end_date"),
+        "status": n["status"],
+        "comments": n.get("comments")
+    } for n in notifications]
+    
+    if channel == "email":
+        send_decision_email(recipient, notifications[0].get("employee_name"), decisions)
+    elif channel == "webhook":
+        response = httpx.post(NOTIFICATION_WEBHOOK_URL, json={"recipient": recipient, "decisions": decisions}, timeout=10)
+        response.raise_for_status()
+
+def _finish(notifications: list, failed_channels: set, now: datetime):
+    for n in notifications:
+        remaining = [c for c in n["pending_channels"] if c in failed_channels]
+        if not remaining:
+            notifications_collection.update_one(
+                {"_id": n["_id"], "claimed_by": WORKER_ID},
+                {"$set": {"state": "sent", "sent_at": now, "pending_channels": []}}
+            )
+            continue
+        
+        attempts = n["attempts"] + 1
+        if attempts >= NOTIFICATION_MAX_ATTEMPTS:
+            state, next_attempt_at = "failed", now
+            print(f"Giving up on notification {n['_id']} to {n['recipient']} after {attempts} attempts")
+        else:
+            state = "pending"
+            next_attempt_at = now + timedelta(seconds=NOTIFICATION_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+        
+        notifications_collection.update_one(
+            {"_id": n["_id"], "claimed_by": WORKER_ID},
+            {"$set": {"state": state, "attempts": attempts, "pending_channels": remaining, "next_attempt_at": next_attempt_at}}
+        )
+
+def dispatch_notifications() -> int:
+    """
+    Deliver due notifications, one message per recipient and channel
+    Decisions landing within the same dispatch interval are batched together
+
+    Returns:
+        Number of notifications processed
+    """
+    now = datetime.now(timezone.utc)
+    claimed = _claim_due(now)
+    
+    by_recipient = defaultdict(list)
+    for n in claimed:
+        by_recipient[n["recipient"]].append(n)
+    
+    for recipient, notifications in by_recipient.items():
+        # Each group is renewed before and finished right after sending, so no other worker re-claims it meanwhile
+        notifications = _renew_claim(notifications)
+        if not notifications:
+            continue
+        
+        failed_channels = set()
+        channels = {c for n in notifications for c in n["pending_channels"]}
+        for channel in channels:
+            pending = [n for n in notifications if channel in n["pending_channels"]]
+            try:
+                _deliver(channel, recipient, pending)
+            except Exception as e:
+                print(f"Notification {channel} delivery to {recipient} failed: {str(e)}")
+                failed_channels.add(channel)
+        _finish(notifications, failed_channels, datetime.now(timezone.utc))
+    
+    return len(claimed)
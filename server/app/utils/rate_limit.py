@@ -0,0 +1,259 @@
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, Request
+from pymongo import ReturnDocument
+
+load_dotenv()
+
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+
+# Token bucket per key type: (capacity, tokens refilled per minute)
+# "ip" buckets are charged for every attempt; "user" and "manager" buckets only for failed passwords,
+# so a manager approving a backlog from their inbox is never throttled
+RATE_LIMIT_POLICIES = {
+    "ip": (int(os.getenv("RATE_LIMIT_IP_CAPACITY", 30)), float(os.getenv("RATE_LIMIT_IP_PER_MINUTE", 30))),
+    "user": (int(os.getenv("RATE_LIMIT_USER_CAPACITY", 5)), float(os.getenv("RATE_LIMIT_USER_PER_MINUTE", 1))),
+    "manager": (int(os.getenv("RATE_LIMIT_MANAGER_CAPACITY", 5)), float(os.getenv("RATE_LIMIT_MANAGER_PER_MINUTE", 1))),
+    # Per-tenant limits: all authenticated API calls, and leave submissions on top
+    "org": (int(os.getenv("TENANT_RATE_CAPACITY", 600)), float(os.getenv("TENANT_RATE_PER_MINUTE", 600))),
+    "org-submit": (int(os.getenv("TENANT_SUBMIT_CAPACITY", 100)), float(os.getenv("TENANT_SUBMIT_PER_MINUTE", 60))),
+}
+
+# Exponential lockout after repeated failed password checks, per account only:
+# locking out an IP would lock out everyone behind the same office NAT or mail proxy
+LOCKOUT_KEY_TYPES = ("user", "manager")
+LOCKOUT_THRESHOLD = int(os.getenv("LOCKOUT_THRESHOLD", 5))
+LOCKOUT_BASE_SECONDS = int(os.getenv("LOCKOUT_BASE_SECONDS", 30))
+LOCKOUT_MAX_SECONDS = int(os.getenv("LOCKOUT_MAX_SECONDS", 3600))
+
+# Number of proxies in front of the app that append to X-Forwarded-For (1 for Heroku's router, 0 when exposed directly)
+TRUSTED_PROXY_COUNT = int(os.getenv("TRUSTED_PROXY_COUNT", 1))
+
+# How long an untouched bucket/failure counter is kept around
+STATE_TTL = timedelta(hours=24)
+
+def _lockout_seconds(failures: int) -> float:
+    if failures < LOCKOUT_THRESHOLD:
+        return 0
+    return min(LOCKOUT_MAX_SECONDS, LOCKOUT_BASE_SECONDS * 2 ** (failures - LOCKOUT_THRESHOLD))
+
+class MemoryRateLimitBackend:
+    """
+    Keeps buckets in process memory
+    Limits are per worker, which is fine for single-worker deployments
+    """
+
+    def __init__(self, max_keys: int = 100000):
+        self._state = {}
+        self._lock = threading.Lock()
+        self._max_keys = max_keys
+
+    def _entry(self, key: str, capacity: int, now: float) -> dict:
+        entry = self._state.get(key)
+        if entry is None:
+            if len(self._state) >= self._max_keys:
+                self._prune(now)
+            entry = {"tokens": capacity, "updated_at": now, "failures": 0, "locked_until": 0}
+            self._state[key] = entry
+        return entry
+
+    def _prune(self, now: float):
+        cutoff = now - STATE_TTL.total_seconds()
+        for key in [k for k, v in self._state.items() if v["updated_at"] < cutoff]:
+            del self._state[key]
+
+    def consume(self, key: str, capacity: int, per_second: float, cost: int = 1) -> float:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entry(key, capacity, now)
+            entry["tokens"] = min(capacity, entry["tokens"] + (now - entry["updated_at"]) * per_second)
+            entry["updated_at"] = now
+            if entry["locked_until"] > now:
+                return entry["locked_until"] - now
+            if entry["tokens"] < 1:
+                return (1 - entry["tokens"]) / per_second
+            entry["tokens"] -= cost
+            return 0
+
+    def register_failure(self, key: str, capacity: int):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entry(key, capacity, now)
+            entry["failures"] += 1
+            lockout = _lockout_seconds(entry["failures"])
+            if lockout:
+                entry["locked_until"] = now + lockout
+
+    def reset_failures(self, key: str):
+        with self._lock:
+            entry = self._state.get(key)
+            if entry:
+                entry["failures"] = 0
+                entry["locked_until"] = 0
+
+class MongoRateLimitBackend:
+    """
+    Keeps buckets in a shared collection so all workers enforce the same limits
+    Each check is a single atomic pipeline update on the bucket document
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def consume(self, key: str, capacity: int, per_second: float, cost: int = 1) -> float:
+        now = datetime.now(timezone.utc)
+        elapsed = {"$divide": [{"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}, 1000]}
+        refilled = {"$min": [capacity, {"$add": [{"$ifNull": ["$tokens", capacity]}, {"$multiply": [elapsed, per_second]}]}]}
+        doc = self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {
+                    "tokens": refilled,
+                    "updated_at": now,
+                    "locked": {"$gt": [{"$ifNull": ["$locked_until", now]}, now]}
+                }},
+                {"$set": {"allowed": {"$and": [{"$not": ["$locked"]}, {"$gte": ["$tokens", 1]}]}}},
+                {"$set": {
+                    "tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", cost]}, "$tokens"]},
+                    "expires_at": now + STATE_TTL
+                }}
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if doc["locked"]:
+            return (doc["locked_until"].replace(tzinfo=timezone.utc) - now).total_seconds()
+        if not doc["allowed"]:
+            return (1 - doc["tokens"]) / per_second
+        return 0
+
+    def register_failure(self, key: str, capacity: int):
+        now = datetime.now(timezone.utc)
+        lockout_ms = {"$min": [
+            LOCKOUT_MAX_SECONDS * 1000,
+            {"$multiply": [LOCKOUT_BASE_SECONDS * 1000, {"$pow": [2, {"$subtract": ["$failures", LOCKOUT_THRESHOLD]}]}]}
+        ]}
+        self.collection.update_one(
+            {"_id": key},
+            [
+                {"$set": {"failures": {"$add": [{"$ifNull": ["$failures", 0]}, 1]}}},
+                {"$set": {
+                    "locked_until": {"$cond": [
+                        {"$gte": ["$failures", LOCKOUT_THRESHOLD]},
+                        {"$add": [now, lockout_ms]},
+                        {"$ifNull": ["$locked_until", None]}
+                    ]},
+                    "expires_at": now + STATE_TTL
+                }}
+            ],
+            upsert=True
+        )
+
+    def reset_failures(self, key: str):
+        self.collection.update_one({"_id": key}, {"$unset": {"failures": "", "locked_until": ""}})
+
+def _create_backend():
+    if RATE_LIMIT_BACKEND == "mongo":
+        from app.models.db import rate_limits_collection
+        return MongoRateLimitBackend(rate_limits_collection)
+    return MemoryRateLimitBackend()
+
+backend = _create_backend()
+
+def set_backend(new_backend):
+    """
+    Swap the rate limit storage (e.g. for a custom shared store)
+
+    Args:
+        new_backend: Object implementing consume (with a cost, 0 to only check), register_failure and reset_failures
+    """
+    global backend
+    backend = new_backend
+
+def _policy(key: str):
+    capacity, per_minute = RATE_LIMIT_POLICIES[key.split(":", 1)[0]]
+    return capacity, per_minute / 60
+
+def client_ip(request: Request) -> str:
+    """
+    Get the caller's IP, honouring the proxy header set by Heroku's router
+    Proxies append the address they saw, so only the last TRUSTED_PROXY_COUNT entries
+    can be trusted - anything before them was sent by the client and may be forged
+    """
+    peer = request.client.host if request.client else "unknown"
+    forwarded = request.headers.get("X-Forwarded-For")
+    if not forwarded or TRUSTED_PROXY_COUNT <= 0:
+        return peer
+    
+    entries = [entry.strip() for entry in forwarded.split(",") if entry.strip()]
+    if len(entries) < TRUSTED_PROXY_COUNT:
+        return peer
+    return entries[-TRUSTED_PROXY_COUNT]
+
+def check_rate_limit(*keys: str):
+    """
+    Take one token from each bucket, rejecting the request if any is empty or locked
+    Call this before any password verification so throttled callers cost no bcrypt work
+
+    Args:
+        keys: Bucket keys such as "ip:1.2.3.4", "user:alice", "manager:<id>", "org:<org_id>"
+
+    Raises:
+        HTTPException 429 with a Retry-After header
+    """
+    retry_after = 0
+    for key in keys:
+        capacity, per_second = _policy(key)
+        retry_after = max(retry_after, backend.consume(key, capacity, per_second))
+    
+    if retry_after > 0:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many attempts. Please wait before trying again.",
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
+
+def check_lockout(*keys: str):
+    """
+    Reject the request if an account key is locked out or its failure bucket is empty, without charging it
+    Use for "user:"/"manager:" keys, which record_failure charges
+
+    Raises:
+        HTTPException 429 with a Retry-After header
+    """
+    retry_after = 0
+    for key in keys:
+        capacity, per_second = _policy(key)
+        retry_after = max(retry_after, backend.consume(key, capacity, per_second, cost=0))
+    
+    if retry_after > 0:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many failed attempts. Please wait before trying again.",
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
+
+def record_failure(*keys: str):
+    """
+    Count a failed password check against account keys: it takes a token from their bucket,
+    and repeated failures lock them out with exponential backoff
+    Other keys (e.g. "ip:") are only throttled by check_rate_limit and are ignored here
+    """
+    for key in keys:
+        if key.split(":", 1)[0] not in LOCKOUT_KEY_TYPES:
+            continue
+        capacity, per_second = _policy(key)
+        backend.consume(key, capacity, per_second)
+        backend.register_failure(key, capacity)
+
+def record_success(*keys: str):
+    """
+    Clear the failure counters after a successful password check
+    """
+    for key in keys:
+        backend.reset_failures(key)
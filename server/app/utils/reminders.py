@@ -0,0 +1,197 @@
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from dotenv import load_dotenv
+from pymongo import ASCENDING
+
+from app.models.db import leaves_collection, users_collection, DEFAULT_ORG_ID
+from app.utils.email import send_leave_action_email, email_configured
+from app.utils.tokens import revoke_tokens_for_leave
+from app.utils.events import emit_event
+from app.utils.resilience import smtp_breaker
+
+load_dotenv()
+
+# SLAs for pending leaves
+REMINDER_AFTER_HOURS = int(os.getenv("REMINDER_AFTER_HOURS", 24))
+ESCALATE_AFTER_HOURS = int(os.getenv("ESCALATE_AFTER_HOURS", 72))
+ESCALATION_EMAIL = os.getenv("ESCALATION_EMAIL")
+
+REMINDER_BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE", 100))
+REMINDER_SCAN_INTERVAL_SECONDS = int(os.getenv("REMINDER_SCAN_INTERVAL_SECONDS", 900))
+
+def _stale_pending_leaves(cutoff: str):
+    """
+    Yield pending leaves not notified since the cutoff, oldest first, in batches
+    Pages on (created_at, _id) so every page is an index range scan
+    """
+    base_query = {
+        "status": "pending",
+        "is_action_taken": False,
+        "created_at": {"$lt": cutoff},
+        "$or": [
+            {"last_notified_at": {"$exists": False}},
+            {"last_notified_at": {"$lt": cutoff}}
+        ]
+    }
+    last = None
+    while True:
+        query = base_query
+        if last:
+            query = {"$and": [base_query, {"$or": [
+                {"created_at": {"$gt": last["created_at"]}},
+                {"created_at": last["created_at"], "_id": {"$gt": last["_id"]}}
+            ]}]}
+        
+        batch = list(leaves_collection.find(query)
+                     .sort([("created_at", ASCENDING), ("_id", ASCENDING)])
+                     .limit(REMINDER_BATCH_SIZE))
+        if not batch:
+            return
+        yield batch
+        last = batch[-1]
+
+def _find_escalation_approver(leave: dict) -> Optional[dict]:
+    """
+    Pick who takes over a leave the manager did not act on:
+    the manager's backup approver, then ESCALATION_EMAIL, then HR (same department first)
+    """
+    # Approvers are only ever picked from the leave's own organization
+    org_id = leave.get("org_id", DEFAULT_ORG_ID)
+    manager = users_collection.find_one({"_id": leave["manager_id"]})
+    if manager and manager.get("backup_approver_email"):
+        backup = users_collection.find_one({"org_id": org_id, "email": manager["backup_approver_email"]})
+        if backup:
+            return backup
+    
+    if ESCALATION_EMAIL:
+        approver = users_collection.find_one({"org_id": org_id, "email": ESCALATION_EMAIL})
+        if approver:
+            return approver
+    
+    return (users_collection.find_one({"org_id": org_id, "is_hr": True, "department": leave.get("employee_department")})
+            or users_collection.find_one({"org_id": org_id, "is_hr": True}))
+
+def _claim(leave: dict, now: str, extra: Optional[dict] = None) -> bool:
+    """
+    Mark a leave as notified, only if nobody else did since we read it
+    """
+    update = {"last_notified_at": now}
+    update.update(extra or {})
+    result = leaves_collection.update_one(
+        {
+            "org_id": leave.get("org_id"),
+            "_id": leave["_id"],
+            "is_action_taken": False,
+            "last_notified_at": leave.get("last_notified_at")
+        },
+        {"$set": update, "$inc": {"reminder_count": 1}}
+    )
+    return result.modified_count > 0
+
+def _release_claim(leave: dict, now: str, extra_fields: tuple = ()):
+    """
+    Undo _claim after the email could not be sent, so the next cycle tries again
+    Fields set by the claim are restored to their previous values
+    """
+    restore, remove = {}, {}
+    for field in ("last_notified_at",) + extra_fields:
+        if leave.get(field) is None:
+            remove[field] = ""
+        else:
+            restore[field] = leave[field]
+    update = {"$inc": {"reminder_count": -1}}
+    if restore:
+        update["$set"] = restore
+    if remove:
+        update["$unset"] = remove
+    leaves_collection.update_one({"org_id": leave.get("org_id"), "_id": leave["_id"], "is_action_taken": False, "last_notified_at": now}, update)
+
+def _send(leave: dict, subject_prefix: str) -> bool:
+    """
+    Email fresh tokens to the current approver, then revoke the ones sent before
+    Old links keep working until the new email is out
+    """
+    sent_after = datetime.now(timezone.utc)
+    if not send_leave_action_email({"_id": leave["_id"]}, subject_prefix=subject_prefix):
+        return False
+    revoke_tokens_for_leave(str(leave["_id"]), created_before=sent_after)
+    return True
+
+def _escalate(leave: dict, now: str) -> bool:
+    approver = _find_escalation_approver(leave)
+    if not approver or approver["_id"] == leave["manager_id"]:
+        return False
+    
+    reassignment = {
+        "manager_id": approver["_id"],
+        "manager_email": approver["email"],
+        "escalated_from": leave["manager_id"],
+        "escalated_at": now
+    }
+    if not _claim(leave, now, reassignment):
+        return False
+    
+    # Tokens of the previous approver stop working only once the new approver has theirs
+    if not _send(leave, "Escalated: "):
+        _release_claim(leave, now, tuple(reassignment))
+        print(f"Escalation email for leave {leave['_id']} failed, will retry")
+        return False
+    
+    # escalated_from lets live dashboards drop the leave from the previous manager's queue
+    emit_event("leave.escalated", {**leave, **reassignment, "last_notified_at": now})
+    print(f"Escalated leave {leave['_id']} to {approver['email']}")
+    return True
+
+def _remind(leave: dict, now: str) -> bool:
+    if not _claim(leave, now):
+        return False
+    
+    # The previous email's tokens are replaced by the ones in the reminder
+    if not _send(leave, "Reminder: "):
+        _release_claim(leave, now)
+        print(f"Reminder for leave {leave['_id']} failed, will retry")
+        return False
+    print(f"Sent reminder for leave {leave['_id']} to {leave.get('manager_email')}")
+    return True
+
+def run_reminder_cycle() -> dict:
+    """
+    Remind managers about pending leaves past the reminder SLA
+    and escalate the ones past the escalation SLA
+    
+    Returns:
+        Counts of reminded and escalated leaves
+    """
+    if not email_configured():
+        print("Email configuration not available, skipping leave reminders")
+        return {"reminded": 0, "escalated": 0}
+    
+    if smtp_breaker.is_open():
+        print("SMTP unavailable (circuit open), postponing leave reminders")
+        return {"reminded": 0, "escalated": 0}
+    
+    now = datetime.now(timezone.utc)
+    reminder_cutoff = (now - timedelta(hours=REMINDER_AFTER_HOURS)).isoformat()
+    escalation_cutoff = (now - timedelta(hours=ESCALATE_AFTER_HOURS)).isoformat()
+    now_iso = now.isoformat()
+    
+    reminded = escalated = 0
+    for batch in _stale_pending_leaves(reminder_cutoff):
+        for leave in batch:
+            try:
+                if leave["created_at"] < escalation_cutoff and not leave.get("escalated_at") and _escalate(leave, now_iso):
+                    escalated += 1
+                elif _remind(leave, now_iso):
+                    reminded += 1
+            except Exception as e:
+                print(f"Reminder failed for leave {leave['_id']}: {str(e)}")
+    
+    if reminded or escalated:
+        print(f"Leave reminders: {reminded} reminded, {escalated} escalated")
+    return {"reminded": reminded, "escalated": escalated}
+
+if __name__ == "__main__":
+    # Allows running a single cycle from cron: python -m app.utils.reminders
+    run_reminder_cycle()
@@ -0,0 +1,133 @@
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5))
+BREAKER_RESET_SECONDS = int(os.getenv("BREAKER_RESET_SECONDS", 30))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose breaker is open"""
+
+class CircuitBreaker:
+    """
+    Stops calling a failing dependency for a while instead of letting every request wait on it
+
+    closed:    calls go through; `failure_threshold` consecutive failures open the breaker
+    open:      calls fail immediately with CircuitOpenError for `reset_timeout` seconds
+    half_open: a single probe call goes through; success closes the breaker, failure opens it again
+    """
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_timeout: int = BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_started_at = None
+        self._last_error = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def is_open(self) -> bool:
+        """
+        True while calls are being rejected (does not take the half-open probe slot)
+        """
+        return self.state == OPEN
+
+    def allow(self) -> bool:
+        """
+        Whether a call may go through now; in half-open state only one probe is let through
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN:
+                if now - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = HALF_OPEN
+                self._probe_started_at = None
+            # A probe that never reported back doesn't block the breaker forever
+            if self._probe_started_at is None or now - self._probe_started_at >= self.reset_timeout:
+                self._probe_started_at = now
+                return True
+            return False
+
+    def record_success(self):
+        if self._state == CLOSED and self._failures == 0:
+            return
+        with self._lock:
+            if self._state != CLOSED:
+                print(f"Circuit breaker '{self.name}' closed")
+            self._state = CLOSED
+            self._failures = 0
+            self._probe_started_at = None
+
+    def record_failure(self, error: Exception = None):
+        with self._lock:
+            self._failures += 1
+            self._last_error = str(error) if error else None
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    print(f"Circuit breaker '{self.name}' opened after {self._failures} failure(s): {self._last_error}")
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self._probe_started_at = None
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call func through the breaker
+
+        Raises:
+            CircuitOpenError if the breaker is open, otherwise whatever func raises
+        """
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} is unavailable (circuit open)")
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self.record_failure(e)
+            raise
+        self.record_success()
+        return result
+
+    def snapshot(self) -> dict:
+        state = self.state
+        with self._lock:
+            retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at)) if state == OPEN else 0.0
+            return {
+                "name": self.name,
+                "state": state,
+                "consecutive_failures": self._failures,
+                "last_error": self._last_error,
+                "retry_in_seconds": round(retry_in, 1)
+            }
+
+breakers = {}
+
+def get_breaker(name: str, **kwargs) -> CircuitBreaker:
+    """
+    Shared breaker for a dependency, created on first use
+    """
+    if name not in breakers:
+        breakers[name] = CircuitBreaker(name, **kwargs)
+    return breakers[name]
+
+smtp_breaker = get_breaker("smtp")
+tokens_breaker = get_breaker("approval_tokens")
+mongo_breaker = get_breaker("mongodb")
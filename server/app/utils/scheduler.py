@@ -0,0 +1,94 @@
+import asyncio
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+
+from pymongo.errors import DuplicateKeyError
+
+from app.models.db import scheduler_locks_collection
+
+# Identifies this process as a lease owner
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+_jobs = []
+_tasks = []
+
+def acquire_lease(name: str, seconds: int) -> bool:
+    """
+    Take or renew a named lease so only one worker runs a job at a time
+
+    Args:
+        name: Lease name (one per job)
+        seconds: How long the lease is held unless renewed
+
+    Returns:
+        True if this worker holds the lease, False if another worker does
+    """
+    now = datetime.now(timezone.utc)
+    try:
+        scheduler_locks_collection.find_one_and_update(
+            {"_id": name, "$or": [{"owner": WORKER_ID}, {"lease_expires_at": {"$lte": now}}]},
+            {"$set": {"owner": WORKER_ID, "lease_expires_at": now + timedelta(seconds=seconds)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        # The lease document exists and is held by a live worker
+        return False
+
+def release_lease(name: str):
+    """
+    Give up a lease held by this worker so another one can take over immediately
+    """
+    scheduler_locks_collection.delete_one({"_id": name, "owner": WORKER_ID})
+
+def register_job(name: str, interval_seconds: int, func: Callable[[], object], exclusive: bool = True):
+    """
+    Register a function to run periodically in the background
+
+    Args:
+        name: Job name, also used as the lease name
+        interval_seconds: Pause between two runs
+        func: Blocking function to run; it is executed in a worker thread
+        exclusive: Run on a single worker at a time across the deployment
+    """
+    _jobs.append({"name": name, "interval": interval_seconds, "func": func, "exclusive": exclusive})
+
+async def _run_job(job: dict):
+    # Hold the lease across runs so the job stays on one worker until it stops renewing
+    lease_seconds = max(job["interval"] * 3, 120)
+    while True:
+        try:
+            if not job["exclusive"] or await asyncio.to_thread(acquire_lease, job["name"], lease_seconds):
+                await asyncio.to_thread(job["func"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Scheduled job {job['name']} failed: {str(e)}")
+        await asyncio.sleep(job["interval"])
+
+def start_scheduler():
+    """
+    Start all registered jobs on the running event loop
+    """
+    for job in _jobs:
+        _tasks.append(asyncio.create_task(_run_job(job)))
+    print(f"Scheduler started on {WORKER_ID} with {len(_jobs)} job(s)")
+
+async def stop_scheduler():
+    """
+    Cancel the running jobs and hand their leases over to other workers
+    """
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
+    
+    for job in _jobs:
+        if job["exclusive"]:
+            try:
+                release_lease(job["name"])
+            except Exception as e:
+                print(f"Failed to release lease {job['name']}: {str(e)}")
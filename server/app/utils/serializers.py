@@ -0,0 +1,7 @@
+from bson import ObjectId
+
+def serialize_leave(leave: dict) -> dict:
+    """
+    Make a leave document JSON-friendly by turning every ObjectId into a string
+    """
+    return {key: str(value) if isinstance(value, ObjectId) else value for key, value in leave.items()}
@@ -1,10 +1,11 @@
 import secrets
 from datetime import datetime, timedelta, timezone
-from app.models.db import tokens_collection
+from app.models.db import tokens_collection, DEFAULT_ORG_ID
+from app.utils.resilience import tokens_breaker
 from bson import ObjectId
 from typing import Optional
 
-def generate_approval_token(leave_id: str, manager_id: str, action: str = "approve", hours_valid: int = 24) -> str:
+def generate_approval_token(leave_id: str, manager_id: str, action: str = "approve", hours_valid: int = 24, org_id: str = DEFAULT_ORG_ID) -> str:
     """
     Generate a unique one-time token for leave approval/rejection
     
@@ -13,6 +14,7 @@ def generate_approval_token(leave_id: str, manager_id: str, action: str = "appro
         manager_id: The manager's user ID
         action: "approve" or "reject"
         hours_valid: How many hours the token is valid (default 24)
+        org_id: Organization the leave belongs to
     
     Returns:
         The generated token string
@@ -22,6 +24,7 @@ def generate_approval_token(leave_id: str, manager_id: str, action: str = "appro
     
     token_doc = {
         "token": token,
+        "org_id": org_id,
         "leave_id": leave_id,
         "manager_id": manager_id,
         "action": action,
@@ -30,7 +33,8 @@ def generate_approval_token(leave_id: str, manager_id: str, action: str = "appro
         "created_at": datetime.now(timezone.utc)
     }
     
-    tokens_collection.insert_one(token_doc)
+    # Fails fast with CircuitOpenError while token storage keeps failing
+    tokens_breaker.call(tokens_collection.insert_one, token_doc)
     return token
 
 def verify_token(token: str) -> Optional[dict]:
@@ -71,7 +75,8 @@ def use_token(token: str) -> bool:
 def cleanup_expired_tokens():
     """
     Remove expired tokens from the database
-    This should be called periodically (e.g., via a cron job)
+    The TTL indexes created by ensure_indexes purge expired, used and revoked
+    tokens continuously; this remains for purging on demand
     """
     result = tokens_collection.delete_many({
         "expires_at": {"$lt": datetime.now(timezone.utc)}
@@ -80,16 +85,20 @@ def cleanup_expired_tokens():
     print(f"Cleaned up {result.deleted_count} expired tokens")
     return result.deleted_count
 
-def revoke_tokens_for_leave(leave_id: str):
+def revoke_tokens_for_leave(leave_id: str, created_before: Optional[datetime] = None):
     """
     Revoke all tokens for a specific leave request
     Useful when leave is processed through other means
     
     Args:
         leave_id: The leave request ID
+        created_before: Only revoke tokens created before this time (e.g. the ones a new email replaces)
     """
+    query = {"leave_id": leave_id, "is_used": False}
+    if created_before:
+        query["created_at"] = {"$lt": created_before}
     result = tokens_collection.update_many(
-        {"leave_id": leave_id, "is_used": False},
+        query,
         {"$set": {"is_used": True, "revoked_at": datetime.now(timezone.utc)}}
     )
     
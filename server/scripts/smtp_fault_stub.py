@@ -0,0 +1,88 @@
+"""
+Local SMTP server that misbehaves on purpose, to check timeouts and the SMTP circuit breaker
+
+Usage:
+    python scripts/smtp_fault_stub.py --mode hang
+
+Then run the API with:
+    EMAIL_HOST=localhost EMAIL_PORT=2525 EMAIL_USE_TLS=false EMAIL_USER=test@example.com EMAIL_PASS=test
+
+Modes:
+    ok     accept every message (printed to the console)
+    hang   accept connections but never answer
+    slow   answer every command after --delay seconds
+    fail   reject connections with 421
+    flaky  fail every other connection
+"""
+import argparse
+import asyncio
+
+async def _reply(writer, line: str, delay: float):
+    if delay:
+        await asyncio.sleep(delay)
+    writer.write(f"{line}\r\n".encode())
+    await writer.drain()
+
+async def handle(reader, writer, mode: str, delay: float, state: dict):
+    state["connections"] += 1
+    peer = writer.get_extra_info("peername")
+    print(f"Connection #{state['connections']} from {peer} ({mode})")
+    
+    try:
+        if mode == "hang":
+            await reader.read()
+            return
+        if mode == "fail" or (mode == "flaky" and state["connections"] % 2 == 0):
+            await _reply(writer, "421 Service not available", 0)
+            return
+        
+        delay = delay if mode == "slow" else 0
+        await _reply(writer, "220 smtp-fault-stub ready", delay)
+        in_data = False
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            text = line.decode(errors="replace").rstrip("\r\n")
+            
+            if in_data:
+                if text == ".":
+                    in_data = False
+                    print("Message accepted")
+                    await _reply(writer, "250 OK", delay)
+                continue
+            
+            command = text.split(" ", 1)[0].upper()
+            if command in ("EHLO", "HELO"):
+                await _reply(writer, "250-smtp-fault-stub\r\n250 AUTH PLAIN LOGIN", delay)
+            elif command == "AUTH":
+                await _reply(writer, "235 Authentication successful", delay)
+            elif command == "DATA":
+                in_data = True
+                await _reply(writer, "354 End data with <CR><LF>.<CR><LF>", delay)
+            elif command == "QUIT":
+                await _reply(writer, "221 Bye", 0)
+                return
+            else:
+                await _reply(writer, "250 OK", delay)
+    finally:
+        writer.close()
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2525)
+    parser.add_argument("--mode", choices=["ok", "hang", "slow", "fail", "flaky"], default="ok")
+    parser.add_argument("--delay", type=float, default=30, help="Reply delay in seconds for --mode slow")
+    args = parser.parse_args()
+    
+    state = {"connections": 0}
+    server = await asyncio.start_server(
+        lambda r, w: handle(r, w, args.mode, args.delay, state), args.host, args.port
+    )
+    print(f"SMTP fault stub listening on {args.host}:{args.port} in '{args.mode}' mode")
+    async with server:
+        await server.serve_forever()
+
+if __name__ == "__main__":
+    asyncio.run(main())